@@ -13,4 +13,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BLOG.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Импорт после настройки Django: модулю нужны модели
+from app.websocket import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # HTTP — Django, WebSocket — app.websocket (личные сообщения в реальном времени)
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,6 +88,32 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'blog-cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Версии кешированных страниц и фрагментов (app/caching.py) — общие для всех процессов:
+    # изменение в одном процессе сразу делает устаревшими страницы, фрагменты и ETag в остальных.
+    # Сами страницы и фрагменты лежат в локальном 'default' под ключами с версией
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'versions',
+        'OPTIONS': {
+            # Файловый кеш пересчитывает файлы при каждой записи — держим их немного;
+            # вытесненная версия просто создаётся заново
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -134,3 +161,44 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = 'home'
 LOGIN_URL = 'login'
+
+# Количество постов на странице ленты
+POSTS_PAGE_SIZE = 12
+
+# Комментарии: корневых веток на странице, ответов в ветке при первой загрузке
+# и ответов в одной догрузке "Показать ещё ответы"
+COMMENT_THREADS_PAGE_SIZE = 20
+COMMENT_REPLIES_PER_THREAD = 5
+COMMENT_REPLIES_PAGE_SIZE = 20
+
+# Сообщений переписки при открытии и в одной догрузке "Показать более ранние"
+MESSAGES_PAGE_SIZE = 50
+
+# Результатов на странице поиска
+SEARCH_PAGE_SIZE = 20
+
+# Каталог магазина: товаров на странице и ценовые диапазоны фасета (от, до), руб.
+SHOP_PAGE_SIZE = 24
+SHOP_PRICE_BUCKETS = [
+    (None, 1000),
+    (1000, 5000),
+    (5000, 20000),
+    (20000, None),
+]
+
+# Заголовки X-DB-Queries / X-DB-Time / X-DB-Duplicate-Queries в ответах (app.middleware);
+# превышение бюджета запросов представления пишется в лог app.middleware всегда
+QUERY_BUDGET_HEADERS = DEBUG
+
+# Лайки пишутся событиями в app_likeevent и переносятся в Like пачками обработчиком
+# manage.py flush_likes (app.like_buffer); False — каждый лайк пишется в Like сразу
+LIKE_BUFFER = True
+
+# WebSocket личных сообщений (app.websocket): сколько событий ждёт отправки одному
+# клиенту, прежде чем он получит "resync" вместо них
+REALTIME_QUEUE_SIZE = 100
+
+# Поток уведомлений (SSE): события склеиваются и уходят не чаще раза в
+# NOTIFICATIONS_MIN_INTERVAL секунд; без событий раз в NOTIFICATIONS_KEEPALIVE секунд — пустой комментарий
+NOTIFICATIONS_MIN_INTERVAL = 1
+NOTIFICATIONS_KEEPALIVE = 15
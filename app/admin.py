@@ -59,8 +59,9 @@
 
 
 from django.contrib import admin
-from .models import Post, Category, Product, ProductImage
-from PIL import Image
+from django.db.models.expressions import RawSQL
+from .models import Post, Category, Product, ProductImage, ImageJob
+from .search import fts_query, post_ids_sql
 
 
 class ProductImageInline(admin.TabularInline):
@@ -75,6 +76,12 @@ class PostAdmin(admin.ModelAdmin):
     search_fields = ["title", "content"]
     list_filter = ["created_at"]
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск через FTS5-индекс вместо LIKE '%...%' по полному тексту
+        if not search_term.strip() or not fts_query(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(id__in=RawSQL(*post_ids_sql(search_term))), False
+
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -89,18 +96,16 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ["name", "description"]
     inlines = [ProductImageInline]
 
-    def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        if obj.image:
-            img = Image.open(obj.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(obj.image.path)
-
 
 @admin.register(ProductImage)
 class ProductImageAdmin(admin.ModelAdmin):
     list_display = ['product', 'image', 'is_primary', 'order']
     list_filter = ['product', 'is_primary']
-    search_fields = ['product__name']
\ No newline at end of file
+    search_fields = ['product__name']
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ['model_label', 'object_id', 'field_name', 'status', 'attempts', 'run_after']
+    list_filter = ['status', 'model_label']
+    readonly_fields = ['last_error']
@@ -0,0 +1,160 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache, caches
+from django.utils.connection import ConnectionProxy
+from django.db.models import F, Max, Sum
+from .models import Conversation, Product
+
+
+# Версии — в общем для процессов кеше (settings.CACHES['versions']),
+# данные под ключами с версией — в локальном cache
+versions = ConnectionProxy(caches, 'versions')
+
+
+# Счётчик непрочитанных сообщений пользователя в кеше.
+# При промахе пересобирается из сводок переписок; короткий TTL ограничивает
+# расхождение между процессами при локальном кеше.
+UNREAD_TIMEOUT = 60
+
+
+def unread_key(user_id):
+    return f'unread:{user_id}'
+
+
+def get_unread_count(user_id):
+    count = cache.get(unread_key(user_id))
+    if count is None:
+        count = Conversation.objects.filter(user_id=user_id, last_received_id__gt=F('last_read_id')).with_unread_count(
+        ).aggregate(total=Sum('unread_count'))['total'] or 0
+        cache.set(unread_key(user_id), count, UNREAD_TIMEOUT)
+    return count
+
+
+def incr_unread_count(user_id, delta=1):
+    try:
+        cache.incr(unread_key(user_id), delta)
+    except ValueError:
+        # Ключа нет — значение соберётся при следующем чтении
+        pass
+
+
+def reset_unread_count(user_id):
+    cache.delete(unread_key(user_id))
+
+
+# Версия комментариев поста — часть ключа кешированных фрагментов веток.
+# Новое значение берётся из часов, чтобы после вытеснения ключа не совпасть со старыми фрагментами.
+COMMENT_FRAGMENT_TIMEOUT = 600
+
+
+def comments_version_key(post_id):
+    return f'comments_version:{post_id}'
+
+
+def comments_version(post_id):
+    return versions.get_or_set(comments_version_key(post_id), time.time_ns, None)
+
+
+def bump_comments_version(post_id):
+    versions.set(comments_version_key(post_id), time.time_ns(), None)
+
+
+def bump_comments_versions(post_ids):
+    version = time.time_ns()
+    versions.set_many({comments_version_key(post_id): version for post_id in post_ids}, None)
+
+
+# Карточки постов в ленте кешируются целиком и общие для всех пользователей.
+# Ключ складывается из версий поста (сам пост, лайки, комментарии), профиля автора
+# и общего поколения карточек (пересчёт счётчиков и т.п.).
+POST_CARD_TIMEOUT = 600
+POST_CARDS_GENERATION_KEY = 'post_cards_generation'
+
+
+def post_version_key(post_id):
+    return f'post_version:{post_id}'
+
+
+def profile_version_key(user_id):
+    return f'profile_version:{user_id}'
+
+
+def post_card_version(post):
+    keys = [post_version_key(post.id), profile_version_key(post.author_id), POST_CARDS_GENERATION_KEY]
+    values = versions.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in values}
+    if missing:
+        versions.set_many(missing, None)
+        values.update(missing)
+    return ':'.join(str(values[key]) for key in keys)
+
+
+def profile_version(user_id):
+    return versions.get_or_set(profile_version_key(user_id), time.time_ns, None)
+
+
+def bump_post_version(post_id):
+    versions.set(post_version_key(post_id), time.time_ns(), None)
+
+
+def bump_profile_version(user_id):
+    versions.set(profile_version_key(user_id), time.time_ns(), None)
+
+
+def bump_post_cards_generation():
+    versions.set(POST_CARDS_GENERATION_KEY, time.time_ns(), None)
+
+
+# Страницы магазина для анонимных посетителей кешируются целиком.
+# Любое изменение товара, изображения или категории меняет версию магазина,
+# и все закешированные страницы становятся недоступны разом.
+SHOP_PAGE_TIMEOUT = 600
+SHOP_VERSION_KEY = 'shop_version'
+
+
+def shop_version():
+    return versions.get_or_set(SHOP_VERSION_KEY, time.time_ns, None)
+
+
+def bump_shop_version():
+    versions.set(SHOP_VERSION_KEY, time.time_ns(), None)
+
+
+def shop_last_modified(product_id=None):
+    # Последнее изменение товаров (или одного товара) — считается один раз на версию магазина
+    key = f'shop_last_modified:{shop_version()}:{product_id or "all"}'
+    last_modified = cache.get(key)
+    if last_modified is None:
+        products = Product.objects.all() if product_id is None else Product.objects.filter(pk=product_id)
+        last_modified = products.aggregate(last=Max('updated_at'))['last']
+        if last_modified is not None:
+            cache.set(key, last_modified, SHOP_PAGE_TIMEOUT)
+    return last_modified
+
+
+def cached_shop_facets(filters, count):
+    # Счётчики фасетов каталога общие для всех посетителей и не зависят от сортировки:
+    # полный проход по товарам — раз на версию магазина и набор фильтров
+    params = sorted((name, str(value)) for name, value in filters.items() if name != 'sort')
+    key = f'shop_facets:{shop_version()}:{hashlib.md5(repr(params).encode()).hexdigest()}'
+    return cache.get_or_set(key, count, SHOP_PAGE_TIMEOUT)
+
+
+def cache_anonymous_shop_page(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # Авторизованным — своя шапка; при непоказанных flash-сообщениях страница тоже своя
+        if request.user.is_authenticated or request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+        path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f'shop_page:{shop_version()}:{path_hash}'
+        response = cache.get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, SHOP_PAGE_TIMEOUT)
+        return response
+    return wrapper
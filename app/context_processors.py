@@ -1,8 +1,10 @@
-from .models import Message
+from django.utils.functional import SimpleLazyObject
+from .caching import get_unread_count
 
 
 def unread_messages_count(request):
     if request.user.is_authenticated:
-        count = Message.objects.filter(recipient=request.user, is_read=False).count()
+        # Считается только если шаблон действительно обратится к переменной
+        count = SimpleLazyObject(lambda: get_unread_count(request.user.id))
         return {'unread_messages_count': count}
-    return {'unread_messages_count': 0}
\ No newline at end of file
+    return {'unread_messages_count': 0}
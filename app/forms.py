@@ -63,7 +63,7 @@ class CommentForm(forms.ModelForm):
             parent_id = self.cleaned_data['parent_id']
             try:
                 comment.parent = Comment.objects.get(id=parent_id, post_id=self.post_id)
-            except Comment.DoesNoExist:
+            except Comment.DoesNotExist:
                 comment.parent = None
 
         if commit:
@@ -95,7 +95,8 @@ class UserProfileForm(forms.ModelForm):
         user.email = self.cleaned_data['email']
 
         if commit:
-            user.save()
+            # Версии, зависящие от имени, сбросит сигнал сохранения профиля
+            user.save(update_fields=['username', 'email'])
             user_profile.save()
         return user_profile
 
@@ -114,3 +115,26 @@ class MessageForm(forms.ModelForm):
             'content': 'Сообщения',
         }
 
+
+
+# Фильтры каталога магазина (GET-параметры); невалидные значения просто игнорируются
+class ProductFilterForm(forms.Form):
+    SORT_CHOICES = [
+        ('new', 'Сначала новые'),
+        ('price', 'Сначала дешёвые'),
+        ('-price', 'Сначала дорогие'),
+    ]
+
+    q = forms.CharField(required=False, max_length=200,
+                        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Поиск товаров'}))
+    category = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    min_price = forms.DecimalField(required=False, min_value=0, max_digits=10, decimal_places=2,
+                                   widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'от'}))
+    max_price = forms.DecimalField(required=False, min_value=0, max_digits=10, decimal_places=2,
+                                   widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'до'}))
+    sort = forms.ChoiceField(required=False, choices=SORT_CHOICES,
+                             widget=forms.Select(attrs={'class': 'form-select'}))
+
+    def filters(self):
+        self.is_valid()
+        return {key: value for key, value in self.cleaned_data.items() if value not in (None, '')}
@@ -0,0 +1,114 @@
+import hashlib
+import io
+import os
+import tempfile
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F, Q
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .models import ImageJob
+
+
+# Ширины копий для srcset; копии шире оригинала не делаются
+VARIANT_WIDTHS = (64, 160, 320, 640, 1280)
+WEBP_SUPPORTED = features.check('webp')
+
+
+def resize_in_place(path, max_size):
+    # Пишем во временный файл рядом и атомарно подменяем: пока обработка не закончена,
+    # отдаётся оригинал, а не наполовину записанный файл
+    with Image.open(path) as img:
+        if img.height <= max_size and img.width <= max_size:
+            return False
+        image_format = img.format
+        img.thumbnail((max_size, max_size))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                img.save(tmp, format=image_format)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return True
+
+
+def claim_job(stale_after=600):
+    # Задачи "running", которые висят дольше stale_after секунд, считаются брошенными упавшим обработчиком
+    now = timezone.now()
+    ready = ImageJob.objects.filter(
+        Q(status='pending', run_after__lte=now) |
+        Q(status='running', locked_at__lt=now - timedelta(seconds=stale_after))
+    ).order_by('run_after', 'id')
+    for job in ready[:10]:
+        claimed = ImageJob.objects.filter(pk=job.pk, status=job.status, attempts=job.attempts).update(
+            status='running', locked_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def build_variants(field_file):
+    # Копии называются по хешу содержимого, поэтому их можно кешировать навсегда,
+    # а повторная обработка того же файла ничего не пересоздаёт
+    with field_file.open('rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+
+    variants = []
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        formats = [fmt for fmt in ('webp', 'png' if has_alpha else 'jpeg') if fmt != 'webp' or WEBP_SUPPORTED]
+        for width in sorted({min(width, img.width) for width in VARIANT_WIDTHS}):
+            for fmt in formats:
+                name = f'derived/{digest[:2]}/{digest}-{width}.{fmt}'
+                if not default_storage.exists(name):
+                    height = max(1, round(img.height * width / img.width))
+                    resized = img.resize((width, height), Image.LANCZOS)
+                    if fmt == 'jpeg' and resized.mode != 'RGB':
+                        resized = resized.convert('RGB')
+                    buffer = io.BytesIO()
+                    resized.save(buffer, format=fmt.upper(), quality=82)
+                    default_storage.save(name, ContentFile(buffer.getvalue()))
+                variants.append({'width': width, 'format': fmt, 'name': name})
+    return {'source': field_file.name, 'variants': variants}
+
+
+def run_job(job):
+    model = apps.get_model(job.model_label)
+    instance = model.objects.filter(pk=job.object_id).first()
+    field_file = getattr(instance, job.field_name, None) if instance else None
+    # Объект удалён или файл уже заменён новым — задача неактуальна
+    if not field_file or field_file.name != job.source or not os.path.isfile(field_file.path):
+        return
+    if job.max_size:
+        resize_in_place(field_file.path, job.max_size)
+    manifest = build_variants(field_file)
+    # Обновляем только если за время обработки файл не поменяли
+    model.objects.filter(pk=job.object_id, **{job.field_name: job.source}).update(
+        **{f'{job.field_name}_variants': manifest})
+
+
+def process_job(job):
+    try:
+        run_job(job)
+    except Exception as exc:
+        job.last_error = repr(exc)
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts * 10)
+    else:
+        job.status = 'done'
+        job.last_error = ''
+    job.locked_at = None
+    job.save(update_fields=['status', 'last_error', 'run_after', 'locked_at'])
+    return job.status
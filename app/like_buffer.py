@@ -0,0 +1,132 @@
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import BooleanField, Case, Exists, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .caching import bump_post_version
+from .models import Post, Like, LikeEvent
+
+
+# Буфер лайков. Под популярным постом каждый лайк — запись в app_like и UPDATE одной
+# и той же строки app_post, а у SQLite один писатель на всю базу. Поэтому переключение —
+# одна вставка в app_likeevent (только добавление строк, без общей строки поста),
+# а manage.py flush_likes переносит накопленные события в Like и like_count пачкой
+# в одной транзакции; повторные клики одного пользователя схлопываются в итоговое состояние.
+# События лежат в БД: их видят все процессы и они переживают перезапуск.
+# Чтения (attach_viewer_state, ETag поста, сам toggle_like) накладывают события поверх
+# Like и like_count через with_like_state — пользователь сразу видит свой лайк.
+class Conflict(Exception):
+    # События уже забрал другой обработчик
+    pass
+
+
+def with_like_state(queryset, user_id=None):
+    # Аннотации постов: pending_likes — сколько прибавится к like_count после записи событий,
+    # is_liked — лайк пользователя (последнее событие пары, иначе строка Like)
+    pending = LikeEvent.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+        delta=Sum(Case(When(liked=True, then=Value(1)), default=Value(-1))),
+    ).values('delta')
+    queryset = queryset.annotate(pending_likes=Coalesce(Subquery(pending, output_field=IntegerField()), Value(0)))
+    if user_id is not None:
+        last = LikeEvent.objects.filter(post=OuterRef('pk'), user_id=user_id).order_by('-id').values('liked')[:1]
+        queryset = queryset.annotate(is_liked=Coalesce(
+            Subquery(last, output_field=BooleanField()),
+            Exists(Like.objects.filter(post=OuterRef('pk'), user_id=user_id)),
+        ))
+    return queryset
+
+
+def record(user_id, post_id, liked):
+    # Событие — это ±1, поэтому оно пишется, только если liked отличается от текущего состояния.
+    # Проверка и вставка — один INSERT ... SELECT: два запроса с устаревшим чтением
+    # не запишут два одинаковых события. Возвращает, записано ли событие
+    events = connection.ops.quote_name(LikeEvent._meta.db_table)
+    likes = connection.ops.quote_name(Like._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {events} (user_id, post_id, liked, created_at) SELECT %s, %s, %s, %s '
+            f'WHERE COALESCE('
+            f'(SELECT liked FROM {events} WHERE post_id = %s AND user_id = %s ORDER BY id DESC LIMIT 1), '
+            f'EXISTS(SELECT 1 FROM {likes} WHERE post_id = %s AND user_id = %s)'
+            f') != %s',
+            [user_id, post_id, liked, connection.ops.adapt_datetimefield_value(timezone.now()),
+             post_id, user_id, post_id, user_id, liked],
+        )
+        if not cursor.rowcount:
+            return False
+    # Карточки поста показывают счётчик с учётом событий
+    transaction.on_commit(lambda: bump_post_version(post_id))
+    return True
+
+
+def like_count(post_id):
+    # like_count с учётом ещё не записанных событий
+    return with_like_state(Post.objects.filter(pk=post_id)).values_list(
+        F('like_count') + F('pending_likes'), flat=True,
+    ).first() or 0
+
+
+def flush(batch_size=5000):
+    # Переносит все события пачками по batch_size, каждую — одной транзакцией.
+    # Возвращает (добавлено, удалено) лайков
+    created = deleted = 0
+    while True:
+        try:
+            with transaction.atomic():
+                events = list(LikeEvent.objects.order_by('id').values_list('id', 'user_id', 'post_id', 'liked')[:batch_size])
+                if not events:
+                    return created, deleted
+                result = write(events)
+        except Conflict:
+            continue
+        created, deleted = created + result[0], deleted + result[1]
+
+
+def write(events):
+    batch_size = 500
+    # События забираются удалением: если часть уже удалил другой обработчик, откатываемся.
+    # События удалённых постов и пользователей удаляются каскадом вместе с ними
+    claimed = 0
+    for start in range(0, len(events), batch_size):
+        claimed += LikeEvent.objects.filter(pk__in=[event[0] for event in events[start:start + batch_size]]).delete()[0]
+    if claimed != len(events):
+        raise Conflict
+
+    # Последнее событие пары — итоговое состояние
+    wanted = {(user_id, post_id): liked for pk, user_id, post_id, liked in events}
+    users_by_post = defaultdict(list)
+    for user_id, post_id in wanted:
+        users_by_post[post_id].append(user_id)
+
+    existing = {}
+    for post_id, users in users_by_post.items():
+        for start in range(0, len(users), batch_size):
+            rows = Like.objects.filter(post_id=post_id, user_id__in=users[start:start + batch_size])
+            existing.update(((user_id, post_id), pk) for pk, user_id in rows.values_list('pk', 'user_id'))
+
+    to_create = [Like(user_id=user_id, post_id=post_id)
+                 for (user_id, post_id), liked in wanted.items() if liked and (user_id, post_id) not in existing]
+    to_delete = [existing[pair] for pair, liked in wanted.items() if not liked and pair in existing]
+    # bulk_create и DELETE по id не шлют сигналов Like — счётчики правим ниже разом
+    Like.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+    table = connection.ops.quote_name(Like._meta.db_table)
+    with connection.cursor() as cursor:
+        for start in range(0, len(to_delete), batch_size):
+            chunk = to_delete[start:start + batch_size]
+            cursor.execute(f'DELETE FROM {table} WHERE id IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+    deltas = defaultdict(int)
+    for like in to_create:
+        deltas[like.post_id] += 1
+    for (user_id, post_id), liked in wanted.items():
+        if not liked and (user_id, post_id) in existing:
+            deltas[post_id] -= 1
+    deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+    if deltas:
+        Post.objects.filter(pk__in=deltas).update(like_count=F('like_count') + Case(
+            *(When(pk=post_id, then=Value(delta)) for post_id, delta in deltas.items()),
+            default=Value(0),
+        ))
+    transaction.on_commit(lambda: [bump_post_version(post_id) for post_id in users_by_post])
+    return len(to_create), len(to_delete)
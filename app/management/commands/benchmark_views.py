@@ -0,0 +1,184 @@
+import json
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from app import urls
+from app.models import Post, Comment, Product, Category
+from .seed import SEED_PASSWORD
+
+
+def percentile(samples, percent):
+    # Ближайший ранг: p50 из [1, 2, 3, 4] — 2, p95 — 4
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Прогоняет все представления app/urls.py через тестовый клиент и печатает JSON "
+            "с p50/p95 времени ответа и числом SQL-запросов. Изменения в базе откатываются")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--user', help="Имя пользователя (по умолчанию — автор с наибольшим числом постов)")
+        parser.add_argument('--password', default=SEED_PASSWORD, help="Пароль пользователя для сценария login")
+        parser.add_argument('--cold-cache', action='store_true', help="Очищать кеш перед каждым запросом")
+        parser.add_argument('--only', nargs='*', help="Только перечисленные сценарии")
+        parser.add_argument('--output', help="Записать JSON в файл")
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations должно быть не меньше 1")
+        self.user = self.pick_user(options['user'])
+        self.password = options['password']
+        scenarios = self.scenarios()
+        self.check_coverage(scenarios)
+        if options['only']:
+            scenarios = [scenario for scenario in scenarios if scenario['name'] in options['only']]
+
+        results = {}
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            # Всё, что создают POST-сценарии, откатывается
+            with transaction.atomic():
+                for scenario in scenarios:
+                    results[scenario['name']] = self.run_scenario(scenario, options)
+                transaction.set_rollback(True)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'cold_cache': options['cold_cache'],
+            'user': self.user.username,
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        self.stdout.write(output)
+
+    def pick_user(self, username):
+        if username:
+            user = User.objects.filter(username=username).first()
+        else:
+            author = Post.objects.values('author_id').annotate(n=Count('id')).order_by('-n').first()
+            user = User.objects.filter(pk=author['author_id']).first() if author else None
+        if user is None:
+            raise CommandError("Нет пользователя для прогона — заполните базу: manage.py seed")
+        return user
+
+    def scenarios(self):
+        user = self.user
+        post = Post.objects.filter(author=user).order_by('-comment_count').first()
+        other_post = Post.objects.exclude(author=user).order_by('-like_count').first() or post
+        root = Comment.objects.filter(post=post, parent__isnull=True).order_by('path').first()
+        contact = User.objects.exclude(pk=user.pk).order_by('id').first() or user
+        category = Category.objects.order_by('id').first()
+        product = Product.objects.order_by('-id').first()
+        search_word = post.title.split()[0] if post.title.split() else 'пост'
+
+        def fresh_post():
+            # Удаляемый в сценарии post_delete пост создаётся вне замера
+            return Post.objects.create(author=user, title="Бенчмарк", content="Удаляемый пост").pk
+
+        scenarios = [
+            {'name': 'home', 'url': reverse('home')},
+            {'name': 'my_posts', 'url': reverse('my_posts')},
+            {'name': 'favorites', 'url': reverse('favorites')},
+            {'name': 'search', 'url': reverse('search'), 'data': {'q': search_word}},
+            {'name': 'post_detail', 'url': reverse('post_detail', args=[post.pk])},
+            {'name': 'comment_threads', 'url': reverse('comment_threads', args=[post.pk])},
+            {'name': 'post_create', 'url': reverse('post_create')},
+            {'name': 'post_create (POST)', 'url': reverse('post_create'), 'method': 'post',
+             'data': {'title': "Бенчмарк", 'content': "Текст"}},
+            {'name': 'post_edit', 'url': reverse('post_edit', args=[post.pk])},
+            {'name': 'post_delete (POST)', 'view': 'post_delete', 'method': 'post',
+             'url': lambda: reverse('post_delete', args=[fresh_post()])},
+            {'name': 'toggle_like (POST)', 'url': reverse('toggle_like', args=[other_post.pk]), 'method': 'post'},
+            {'name': 'toggle_like (JSON)', 'url': reverse('toggle_like', args=[other_post.pk]), 'method': 'post',
+             'data': {'state': '1'}, 'extra': {'HTTP_ACCEPT': 'application/json'}},
+            {'name': 'toggle_favorite (POST)', 'url': reverse('toggle_favorite', args=[other_post.pk]),
+             'method': 'post'},
+            {'name': 'add_comment (POST)', 'url': reverse('add_comment', args=[other_post.pk]), 'method': 'post',
+             'data': {'content': "Комментарий"}},
+            {'name': 'messages_list', 'url': reverse('messages_list')},
+            {'name': 'messages_list (dialog)', 'url': reverse('messages_list', args=[contact.pk])},
+            {'name': 'messages_older', 'url': reverse('messages_older', args=[contact.pk])},
+            {'name': 'send_message (POST)', 'url': reverse('send_message', args=[contact.pk]), 'method': 'post',
+             'data': {'content': "Привет"}},
+            # Тестовый клиент — WSGI: поток не открывается, замеряется ответ 204
+            {'name': 'notifications_stream', 'url': reverse('notifications_stream')},
+            {'name': 'profile_view', 'url': reverse('profile_view', args=[contact.username])},
+            {'name': 'profile_edit', 'url': reverse('profile_edit')},
+            {'name': 'shop_home', 'url': reverse('shop_home')},
+            {'name': 'shop_home (anonymous)', 'url': reverse('shop_home'), 'anonymous': True},
+            {'name': 'shop_home (filtered)', 'url': reverse('shop_home'),
+             'data': {'sort': 'price', 'min_price': '1000', 'max_price': '5000'}},
+            {'name': 'register', 'url': reverse('register'), 'anonymous': True},
+            {'name': 'login', 'url': reverse('login'), 'anonymous': True},
+            {'name': 'login (POST)', 'url': reverse('login'), 'method': 'post', 'anonymous': True,
+             'data': {'username': user.username, 'password': self.password}},
+            {'name': 'logout', 'url': reverse('logout')},
+        ]
+        if root:
+            scenarios.append({'name': 'comment_replies',
+                              'url': reverse('comment_replies', args=[post.pk, root.pk])})
+        if category:
+            scenarios.append({'name': 'shop_category', 'url': reverse('shop_category', args=[category.pk])})
+        if product:
+            scenarios.append({'name': 'shop_product_detail', 'url': reverse('shop_product_detail', args=[product.pk])})
+        return scenarios
+
+    def check_coverage(self, scenarios):
+        covered = {scenario.get('view') or resolve(scenario['url']).url_name for scenario in scenarios}
+        missing = {pattern.name for pattern in urls.urlpatterns} - covered
+        if missing:
+            self.stderr.write(f"Без сценария: {', '.join(sorted(missing))}")
+
+    def run_scenario(self, scenario, options):
+        client = Client()
+        timings, query_counts, statuses = [], [], set()
+        for iteration in range(options['warmup'] + options['iterations']):
+            # Вход и подготовка — вне замера
+            if scenario.get('anonymous'):
+                client.logout()
+            else:
+                client.force_login(self.user)
+            url = scenario['url']() if callable(scenario['url']) else scenario['url']
+            if options['cold_cache']:
+                cache.clear()
+
+            method = getattr(client, scenario.get('method', 'get'))
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = method(url, scenario.get('data', {}), **scenario.get('extra', {}))
+                elapsed = time.perf_counter() - start
+            if iteration < options['warmup']:
+                continue
+            timings.append(elapsed * 1000)
+            query_counts.append(len(queries))
+            statuses.add(response.status_code)
+
+        return {
+            'method': scenario.get('method', 'get').upper(),
+            'url': url,
+            'status': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+            'mean_ms': round(statistics.fmean(timings), 2),
+            'queries_p50': percentile(query_counts, 50),
+            'queries_max': max(query_counts),
+            'query_budget': getattr(resolve(url).func, 'query_budget', None),
+        }
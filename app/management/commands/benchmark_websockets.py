@@ -0,0 +1,76 @@
+import asyncio
+import json
+import resource
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from app.realtime import broker
+from app.websocket import InProcessClient
+
+
+class Command(BaseCommand):
+    help = ("Открывает N простаивающих WebSocket-подключений к app.websocket в одном процессе "
+            "(без сервера) и печатает JSON: память на подключение и время рассылки события всем")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000)
+        parser.add_argument('--batch-size', type=int, default=500, help="Сколько подключений открывать одновременно")
+        parser.add_argument('--user', help="Имя пользователя (по умолчанию — первый)")
+
+    def handle(self, *args, **options):
+        if options['connections'] < 1:
+            raise CommandError("--connections должно быть не меньше 1")
+        user = (User.objects.filter(username=options['user']) if options['user'] else User.objects.order_by('id')).first()
+        if user is None:
+            raise CommandError("Нет пользователя — заполните базу: manage.py seed")
+        client = Client()
+        client.force_login(user)
+        self.user_id = user.pk
+        self.cookie = f"sessionid={client.cookies['sessionid'].value}"
+
+        report = async_to_sync(self.run)(options['connections'], options['batch_size'])
+        report['user'] = user.username
+        self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+
+    async def run(self, count, batch_size):
+        # Все подключения одного пользователя: одно событие расходится по всем сразу
+        tracemalloc.start()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        heap_before = tracemalloc.get_traced_memory()[0]
+
+        sockets, start = [], time.perf_counter()
+        for offset in range(0, count, batch_size):
+            batch = [InProcessClient(headers=[('cookie', self.cookie)]) for _ in range(min(batch_size, count - offset))]
+            accepted = await asyncio.gather(*(socket.connect(timeout=30) for socket in batch))
+            if any(event['type'] != 'websocket.accept' for event in accepted):
+                raise CommandError("Подключение отклонено — проверьте сессию пользователя")
+            sockets.extend(batch)
+        connect_seconds = time.perf_counter() - start
+
+        # Простой: подключения только ждут событий
+        await asyncio.sleep(0.5)
+        heap = tracemalloc.get_traced_memory()[0] - heap_before
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        broker.publish(self.user_id, {'type': 'benchmark'})
+        await asyncio.gather(*(socket.receive(timeout=30) for socket in sockets))
+        fanout_ms = (time.perf_counter() - start) * 1000
+
+        connections = broker.connections()
+        await asyncio.gather(*(socket.disconnect() for socket in sockets))
+        return {
+            'connections': connections,
+            'connect_seconds': round(connect_seconds, 2),
+            'heap_bytes_per_connection': round(heap / count),
+            'max_rss_growth_kb': rss,
+            'fanout_ms': round(fanout_ms, 2),
+            # Оценка сверху по памяти Python; у настоящего сервера добавятся буферы
+            # сокетов в ядре и лимит файловых дескрипторов (ulimit -n)
+            'connections_per_gb_estimate': int(2 ** 30 / max(heap / count, 1)),
+        }
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app import like_buffer
+
+
+class Command(BaseCommand):
+    help = "Фоновый обработчик буфера лайков: переносит события LikeEvent в Like и счётчики постов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Записать накопленные события и выйти")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Пауза между записями, с")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Событий в одной транзакции")
+
+    def handle(self, *args, **options):
+        while True:
+            created, deleted = like_buffer.flush(options['batch_size'])
+            if created or deleted:
+                self.stdout.write(f"Лайков добавлено: {created}, удалено: {deleted}")
+            if options['once']:
+                return
+            time.sleep(options['sleep'])
@@ -0,0 +1,71 @@
+import os
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models
+
+
+def referenced_media():
+    # Все имена файлов, на которые ссылаются FileField/ImageField, и копии из полей *_variants
+    names = set()
+    for model in apps.get_models():
+        file_fields = [field.name for field in model._meta.concrete_fields if isinstance(field, models.FileField)]
+        variant_fields = [field.name for field in model._meta.concrete_fields
+                          if isinstance(field, models.JSONField) and field.name.endswith('_variants')]
+        if not file_fields and not variant_fields:
+            continue
+        rows = model._default_manager.values_list(*file_fields, *variant_fields).iterator(chunk_size=2000)
+        for row in rows:
+            names.update(name for name in row[:len(file_fields)] if name)
+            for manifest in row[len(file_fields):]:
+                names.update(variant['name'] for variant in (manifest or {}).get('variants', []))
+    return names
+
+
+def walk_media(root):
+    # Обход MEDIA_ROOT потоком, без построения полного списка файлов
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+class Command(BaseCommand):
+    help = "Удаляет из MEDIA_ROOT файлы, на которые не ссылается ни одна запись"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет удалено")
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help="Не трогать файлы моложе стольких секунд (загрузки, которые ещё не сохранены в БД)")
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        if not os.path.isdir(root):
+            self.stdout.write("MEDIA_ROOT не существует, удалять нечего")
+            return
+
+        referenced = referenced_media()
+        cutoff = time.time() - options['min_age']
+        removed, freed = 0, 0
+        for entry in walk_media(root):
+            name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+            if name in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            removed += 1
+            freed += stat.st_size
+            if options['dry_run']:
+                self.stdout.write(f"будет удалён: {name}")
+            else:
+                os.remove(entry.path)
+
+        verb = "Будет удалено" if options['dry_run'] else "Удалено"
+        self.stdout.write(self.style.SUCCESS(f"{verb} файлов: {removed} ({freed / 1024 / 1024:.1f} МБ)"))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from app.images import claim_job, process_job
+
+
+class Command(BaseCommand):
+    help = "Фоновый обработчик очереди изображений (ImageJob)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Обработать готовые задачи и выйти")
+        parser.add_argument('--sleep', type=float, default=2.0, help="Пауза между опросами пустой очереди, с")
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help="Через сколько секунд задача в статусе running считается брошенной")
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_job(stale_after=options['stale_after'])
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['sleep'])
+                continue
+            process_job(job)
+            self.stdout.write(str(job))
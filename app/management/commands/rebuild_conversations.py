@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from app.models import Message, Conversation
+
+
+def rebuild_conversations(message_model, conversation_model, batch_size=1000):
+    # Итоги по каждому направлению (sender -> recipient) одним GROUP BY
+    directions = message_model.objects.order_by().values('sender_id', 'recipient_id').annotate(last_id=Max('id'))
+
+    summaries = {}
+    for row in directions:
+        sender_id, recipient_id = row['sender_id'], row['recipient_id']
+        for user_id, contact_id in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            summary = summaries.setdefault((user_id, contact_id), {'last_id': 0, 'received_id': 0})
+            summary['last_id'] = max(summary['last_id'], row['last_id'])
+        summaries[(recipient_id, sender_id)]['received_id'] = row['last_id']
+
+    last_ids = sorted({summary['last_id'] for summary in summaries.values()})
+    timestamps = {}
+    for start in range(0, len(last_ids), batch_size):
+        timestamps.update(message_model.objects.filter(
+            id__in=last_ids[start:start + batch_size]).values_list('id', 'timestamp'))
+
+    # Отметки прочтения в сообщениях не хранятся — переносим из старых сводок
+    read_ids = {(user_id, contact_id): read_id for user_id, contact_id, read_id
+                in conversation_model.objects.values_list('user_id', 'contact_id', 'last_read_id')}
+    conversation_model.objects.all().delete()
+    conversation_model.objects.bulk_create([
+        conversation_model(user_id=user_id, contact_id=contact_id, last_message_id=summary['last_id'],
+                           last_message_at=timestamps[summary['last_id']], last_received_id=summary['received_id'],
+                           last_read_id=min(read_ids.get((user_id, contact_id), 0), summary['received_id']))
+        for (user_id, contact_id), summary in summaries.items()
+    ], batch_size=batch_size)
+    return len(summaries)
+
+
+class Command(BaseCommand):
+    help = "Пересобирает сводки переписок (Conversation) по таблице сообщений"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            total = rebuild_conversations(Message, Conversation)
+        self.stdout.write(self.style.SUCCESS(f"Пересобрано сводок: {total}"))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from app.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Пересобирает полнотекстовые индексы FTS5 по постам, комментариям и товарам"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Поисковый индекс пересобран"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from app.models import Post, Like, Comment
+from app.caching import bump_post_cards_generation
+
+
+def count_subquery(model):
+    counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(c=Count('pk')).values('c')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает like_count и comment_count у всех постов"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = Post.objects.update(
+                like_count=count_subquery(Like),
+                comment_count=count_subquery(Comment),
+            )
+        # update() не шлёт сигналов — сбрасываем все кешированные карточки разом
+        bump_post_cards_generation()
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано постов: {updated}"))
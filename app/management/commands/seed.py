@@ -0,0 +1,205 @@
+import random
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from app.caching import bump_shop_version
+from app.models import (UserProfile, Post, Like, Comment, Favorite, Message, Conversation, Category, Product,
+                        Order)
+
+
+SEED_PASSWORD = 'seed-password'
+WORDS = (
+    "блог пост кофе город утро музыка книга лес море код django python сервер запрос кеш индекс "
+    "путешествие фото рецепт погода проект идея вечер друг работа отпуск кино игра спорт"
+).split()
+
+
+def text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def batched(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@contextmanager
+def explicit_dates(model):
+    # bulk_create вызывает pre_save, и auto_now/auto_now_add затёрли бы заданные даты
+    fields = [field for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу синтетическими данными через bulk_create: пользователи, посты, лайки, "
+            f"вложенные комментарии, избранное, сообщения, магазин. Пароль всех пользователей — {SEED_PASSWORD}")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--posts', type=int, default=2000)
+        parser.add_argument('--likes', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=10000)
+        parser.add_argument('--max-depth', type=int, default=4, help="Максимальная глубина ответов")
+        parser.add_argument('--favorites', type=int, default=5000)
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=2000)
+        parser.add_argument('--days', type=int, default=365, help="За сколько дней распределить даты")
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=None, help="Зерно генератора для воспроизводимости")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.start = timezone.now() - timedelta(days=options['days'])
+        self.span = timedelta(days=options['days'])
+
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            posts = self.create_posts(users, options['posts'])
+            self.create_pairs(Like, users, posts, options['likes'])
+            self.create_pairs(Favorite, users, posts, options['favorites'])
+            self.create_comments(users, posts, options['comments'], options['max_depth'])
+            self.create_messages(users, options['messages'])
+            products = self.create_products(options['categories'], options['products'])
+            self.create_orders(users, products, options['orders'])
+
+        # bulk_create не шлёт сигналов — пересобираем денормализованные данные и кеши
+        call_command('recount_post_counters', stdout=self.stdout)
+        call_command('rebuild_conversations', stdout=self.stdout)
+        self.mark_conversations_read()
+        bump_shop_version()
+        self.stdout.write(self.style.SUCCESS("Готово"))
+
+    def timestamps(self, count):
+        return sorted(self.start + self.span * self.rng.random() for _ in range(count))
+
+    def bulk_create(self, model, objects, date_fields=()):
+        if date_fields:
+            # Возрастающие даты: объекты с большим id созданы позже, как в живой базе
+            for obj, moment in zip(objects, self.timestamps(len(objects))):
+                for field in date_fields:
+                    setattr(obj, field, moment)
+        created = []
+        with explicit_dates(model) if date_fields else nullcontext():
+            for batch in batched(objects, self.batch_size):
+                created.extend(model.objects.bulk_create(batch, batch_size=self.batch_size))
+        self.stdout.write(f"{model.__name__}: {len(created)}")
+        return created
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD)
+        suffix = self.rng.randrange(10 ** 6)
+        users = self.bulk_create(User, [
+            User(username=f'user{suffix}_{i}', email=f'user{suffix}_{i}@example.com', password=password)
+            for i in range(count)
+        ])
+        self.bulk_create(UserProfile, [
+            UserProfile(user=user, first_name=self.rng.choice(WORDS).title(), bio=text(self.rng, 12))
+            for user in users
+        ])
+        return users
+
+    def create_posts(self, users, count):
+        return self.bulk_create(Post, [
+            Post(author=self.rng.choice(users), title=text(self.rng, 5), content=text(self.rng, 120))
+            for _ in range(count)
+        ], date_fields=('created_at', 'updated_at'))
+
+    def create_pairs(self, model, users, posts, count):
+        # Уникальные пары (user, post); если пар меньше запрошенного — сколько есть
+        count = min(count, len(users) * len(posts))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((self.rng.choice(users).pk, self.rng.choice(posts).pk))
+        self.bulk_create(model, [model(user_id=user_id, post_id=post_id) for user_id, post_id in pairs],
+                         date_fields=('created_at',))
+
+    def create_comments(self, users, posts, count, max_depth):
+        # id назначаются заранее, чтобы путь (см. Comment.path) был известен до вставки;
+        # уровни идут по порядку — у ответа всегда больший id, чем у родителя
+        next_id = (Comment.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+        comments, level = [], []
+        remaining, depth = count, 0
+        while remaining > 0 and depth <= max_depth:
+            if depth == 0:
+                size = max(1, count // 3)
+            elif depth == max_depth:
+                size = remaining
+            else:
+                size = max(1, remaining // 2)
+            size = min(size, remaining)
+            parents = [self.rng.choice(level) for _ in range(size)] if depth else [None] * size
+            level = []
+            for parent in parents:
+                segment = Comment.path_segment(next_id)
+                level.append(Comment(
+                    id=next_id, parent=parent, depth=depth,
+                    post_id=parent.post_id if parent else self.rng.choice(posts).pk,
+                    path=f"{parent.path}/{segment}" if parent else segment,
+                    author=self.rng.choice(users), content=text(self.rng, 15 if parent else 20),
+                ))
+                next_id += 1
+            comments.extend(level)
+            remaining -= size
+            depth += 1
+        self.bulk_create(Comment, comments, date_fields=('create_at',))
+
+    def create_messages(self, users, count):
+        if len(users) < 2:
+            return
+        messages = []
+        for _ in range(count):
+            sender, recipient = self.rng.sample(users, 2)
+            messages.append(Message(sender=sender, recipient=recipient, content=text(self.rng, 10)))
+        self.bulk_create(Message, messages, date_fields=('timestamp',))
+
+    def mark_conversations_read(self, share=0.8):
+        # Большая часть переписок прочитана целиком, остальные — с непрочитанными
+        ids = list(Conversation.objects.values_list('id', flat=True))
+        read = self.rng.sample(ids, int(len(ids) * share))
+        for batch in batched(read, self.batch_size):
+            Conversation.objects.filter(id__in=batch).update(last_read_id=F('last_received_id'))
+
+    def create_products(self, category_count, count):
+        suffix = self.rng.randrange(10 ** 6)
+        categories = self.bulk_create(Category, [
+            Category(name=f"{self.rng.choice(WORDS).title()} {suffix}-{i}", description=text(self.rng, 10))
+            for i in range(category_count)
+        ])
+        if not categories:
+            return []
+        return self.bulk_create(Product, [
+            Product(name=text(self.rng, 3), description=text(self.rng, 40), category=self.rng.choice(categories),
+                    price=Decimal(self.rng.randrange(100, 5000000)) / 100)
+            for _ in range(count)
+        ], date_fields=('created_at', 'updated_at'))
+
+    def create_orders(self, users, products, count):
+        if not products:
+            return
+        orders = []
+        for _ in range(count):
+            product = self.rng.choice(products)
+            quantity = self.rng.randint(1, 3)
+            orders.append(Order(user=self.rng.choice(users), product=product, quantity=quantity,
+                                total_price=product.price * quantity,
+                                status=self.rng.choice(Order.STATUS_CHOICES)[0]))
+        self.bulk_create(Order, orders, date_fields=('created_at',))
@@ -0,0 +1,126 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+
+# Учёт SQL-запросов каждого запроса к сайту: количество, суммарное время в БД
+# и повторяющиеся запросы (признак N+1). Работает и при DEBUG = False.
+IN_LIST_RE = re.compile(r'\((?:%s, )+%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+def query_budget(max_queries):
+    # Объявленный бюджет запросов представления; его проверяют middleware и тесты
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def fingerprint(sql):
+    # Один и тот же запрос с другими параметрами или длиной IN (...) даёт один отпечаток
+    return NUMBER_RE.sub('N', IN_LIST_RE.sub('(%s...)', sql))
+
+
+def duplicate_queries(statements):
+    return {sql: count for sql, count in Counter(map(fingerprint, statements)).items() if count > 1}
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.statements = []
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.statements.append(sql)
+
+
+# Учёт текущего запроса к сайту — в contextvar: под ASGI синхронные представления и ORM
+# асинхронных работают в потоках sync_to_async со своими соединениями, а контекст
+# переходит туда вместе с вызовом. Обёртка стоит на каждом соединении постоянно
+current_recorder = ContextVar('query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_recorder)
+
+
+class QueryBudgetMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        # Соединения, открытые до загрузки middleware
+        for connection in connections.all():
+            install_recorder(connection)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.report(request, response, recorder)
+
+    async def __acall__(self, request):
+        # Под ASGI цепочка не переходит в поток ради этого middleware — и потоковые
+        # асинхронные представления (notifications_stream) остаются асинхронными
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.report(request, response, recorder)
+
+    def report(self, request, response, recorder):
+        count = len(recorder.statements)
+        duplicates = duplicate_queries(recorder.statements)
+        # Бюджет — с представления, выбранного маршрутом (без process_view: под ASGI
+        # синхронный process_view тоже ушёл бы в поток)
+        budget = getattr(getattr(request.resolver_match, 'func', None), 'query_budget', None)
+        if settings.QUERY_BUDGET_HEADERS:
+            response['X-DB-Queries'] = count
+            response['X-DB-Time'] = f'{recorder.duration * 1000:.1f}ms'
+            response['X-DB-Duplicate-Queries'] = sum(duplicates.values())
+            if budget is not None:
+                response['X-DB-Query-Budget'] = budget
+
+        level = logging.WARNING if budget is not None and count > budget else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, "%s %s: %d queries (budget %s), %.1fms in DB, duplicates: %s",
+                       request.method, request.path, count, budget, recorder.duration * 1000,
+                       {sql[:200]: n for sql, n in duplicates.items()} or 'none')
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:04
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Post = apps.get_model('app', 'Post')
+    Like = apps.get_model('app', 'Like')
+    Comment = apps.get_model('app', 'Comment')
+
+    def count_subquery(model):
+        counts = model.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+            c=Count('pk')).values('c')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Post.objects.update(like_count=count_subquery(Like), comment_count=count_subquery(Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_order_productimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q
+
+
+def fill_conversations(apps, schema_editor):
+    Message = apps.get_model('app', 'Message')
+    Conversation = apps.get_model('app', 'Conversation')
+
+    summaries = {}
+    directions = Message.objects.order_by().values('sender_id', 'recipient_id').annotate(
+        last_id=Max('id'), unread=Count('id', filter=Q(is_read=False)))
+    for row in directions:
+        sender_id, recipient_id = row['sender_id'], row['recipient_id']
+        for key in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            summary = summaries.setdefault(key, {'last_id': 0, 'unread': 0})
+            summary['last_id'] = max(summary['last_id'], row['last_id'])
+        summaries[(recipient_id, sender_id)]['unread'] += row['unread']
+
+    for (user_id, contact_id), summary in summaries.items():
+        last_message = Message.objects.get(id=summary['last_id'])
+        Conversation.objects.create(user_id=user_id, contact_id=contact_id, last_message=last_message,
+                                    last_message_at=last_message.timestamp, unread_count=summary['unread'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_post_created_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='app.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Conversation',
+                'verbose_name_plural': 'Conversations',
+                'indexes': [models.Index(fields=['user', '-last_message_at'], name='conversation_inbox_idx')],
+                'unique_together': {('user', 'contact')},
+            },
+        ),
+        migrations.RunPython(fill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Comment = apps.get_model('app', 'Comment')
+
+    # Родитель всегда создан раньше ответа, поэтому при обходе по id путь родителя уже известен
+    paths, batch = {}, []
+    for comment in Comment.objects.order_by('id').only('id', 'parent_id').iterator(chunk_size=2000):
+        parent = paths.get(comment.parent_id)
+        segment = str(comment.id).zfill(10)
+        comment.path = f"{parent[0]}/{segment}" if parent else segment
+        comment.depth = parent[1] + 1 if parent else 0
+        paths[comment.id] = (comment.path, comment.depth)
+        batch.append(comment)
+        if len(batch) >= 2000:
+            Comment.objects.bulk_update(batch, ['path', 'depth'])
+            batch = []
+    if batch:
+        Comment.objects.bulk_update(batch, ['path', 'depth'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=1000),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+    ]
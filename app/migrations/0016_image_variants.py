@@ -0,0 +1,56 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:13
+
+from django.db import migrations, models
+
+
+def enqueue_existing_images(apps, schema_editor):
+    ImageJob = apps.get_model('app', 'ImageJob')
+    targets = [
+        ('app.Post', 'Post', 'image', None),
+        ('app.Product', 'Product', 'image', 800),
+        ('app.ProductImage', 'ProductImage', 'image', 800),
+        ('app.UserProfile', 'UserProfile', 'avatar', 300),
+    ]
+    for label, model_name, field_name, max_size in targets:
+        model = apps.get_model('app', model_name)
+        rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+        ImageJob.objects.bulk_create([
+            ImageJob(model_label=label, object_id=pk, field_name=field_name, source=name, max_size=max_size)
+            for pk, name in rows.values_list('pk', field_name).iterator()
+        ], batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='imagejob',
+            name='max_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(enqueue_existing_images, migrations.RunPython.noop),
+    ]
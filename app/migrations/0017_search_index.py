@@ -0,0 +1,67 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:20
+
+from django.db import migrations
+
+
+# FTS5-индексы с внешним содержимым и триггеры синхронизации (только SQLite)
+FORWARD_SQL = [
+    """CREATE VIRTUAL TABLE app_post_fts USING fts5(
+        title, content, content='app_post', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER app_post_fts_insert AFTER INSERT ON app_post BEGIN
+        INSERT INTO app_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER app_post_fts_delete AFTER DELETE ON app_post BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER app_post_fts_update AFTER UPDATE OF title, content ON app_post BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO app_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE VIRTUAL TABLE app_comment_fts USING fts5(
+        content, content='app_comment', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER app_comment_fts_insert AFTER INSERT ON app_comment BEGIN
+        INSERT INTO app_comment_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER app_comment_fts_delete AFTER DELETE ON app_comment BEGIN
+        INSERT INTO app_comment_fts(app_comment_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER app_comment_fts_update AFTER UPDATE OF content ON app_comment BEGIN
+        INSERT INTO app_comment_fts(app_comment_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO app_comment_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO app_post_fts(app_post_fts) VALUES ('rebuild')",
+    "INSERT INTO app_comment_fts(app_comment_fts) VALUES ('rebuild')",
+]
+
+BACKWARD_SQL = [
+    "DROP TRIGGER IF EXISTS app_post_fts_insert",
+    "DROP TRIGGER IF EXISTS app_post_fts_delete",
+    "DROP TRIGGER IF EXISTS app_post_fts_update",
+    "DROP TABLE IF EXISTS app_post_fts",
+    "DROP TRIGGER IF EXISTS app_comment_fts_insert",
+    "DROP TRIGGER IF EXISTS app_comment_fts_delete",
+    "DROP TRIGGER IF EXISTS app_comment_fts_update",
+    "DROP TABLE IF EXISTS app_comment_fts",
+]
+
+
+def run_sql(statements):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(BACKWARD_SQL)),
+    ]
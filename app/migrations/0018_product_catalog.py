@@ -0,0 +1,67 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:17
+
+from django.db import migrations, models
+
+
+# FTS5-индекс товаров для текстового фильтра каталога (только SQLite)
+FORWARD_SQL = [
+    """CREATE VIRTUAL TABLE app_product_fts USING fts5(
+        name, description, content='app_product', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER app_product_fts_insert AFTER INSERT ON app_product BEGIN
+        INSERT INTO app_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER app_product_fts_delete AFTER DELETE ON app_product BEGIN
+        INSERT INTO app_product_fts(app_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER app_product_fts_update AFTER UPDATE OF name, description ON app_product BEGIN
+        INSERT INTO app_product_fts(app_product_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO app_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO app_product_fts(app_product_fts) VALUES ('rebuild')",
+]
+
+BACKWARD_SQL = [
+    "DROP TRIGGER IF EXISTS app_product_fts_insert",
+    "DROP TRIGGER IF EXISTS app_product_fts_delete",
+    "DROP TRIGGER IF EXISTS app_product_fts_update",
+    "DROP TABLE IF EXISTS app_product_fts",
+]
+
+
+def run_sql(statements):
+    def apply(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'created_at', 'id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+        ),
+        migrations.RunPython(run_sql(FORWARD_SQL), run_sql(BACKWARD_SQL)),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:18
+
+from django.db import migrations, models
+
+
+def keep_single_primary(apps, schema_editor):
+    ProductImage = apps.get_model('app', 'ProductImage')
+
+    # Если у товара несколько главных изображений, оставляем первое по order
+    seen, extra = set(), []
+    primaries = ProductImage.objects.filter(is_primary=True).order_by('product_id', 'order', 'id')
+    for image_id, product_id in primaries.values_list('id', 'product_id').iterator():
+        if product_id in seen:
+            extra.append(image_id)
+        seen.add(product_id)
+    for start in range(0, len(extra), 500):
+        ProductImage.objects.filter(id__in=extra[start:start + 500]).update(is_primary=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_product_catalog'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_single_primary, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='productimage',
+            index=models.Index(fields=['product', 'order', 'id'], name='productimage_order_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_primary', True)), fields=('product',), name='productimage_one_primary'),
+        ),
+    ]
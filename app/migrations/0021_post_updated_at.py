@@ -0,0 +1,53 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_updated_at(apps, schema_editor):
+    Post = apps.get_model('app', 'Post')
+    # Для существующих постов точной даты правки нет — берём дату создания
+    Post.objects.update(updated_at=models.F('created_at'))
+
+
+# AddField в SQLite пересоздаёт таблицу app_post, и триггеры FTS5 из 0017 удаляются вместе
+# со старой таблицей — создаём их заново
+POST_FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS app_post_fts_insert AFTER INSERT ON app_post BEGIN
+        INSERT INTO app_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_post_fts_delete AFTER DELETE ON app_post BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS app_post_fts_update AFTER UPDATE OF title, content ON app_post BEGIN
+        INSERT INTO app_post_fts(app_post_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO app_post_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+
+def restore_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in POST_FTS_TRIGGERS:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_product_updated_idx'),
+    ]
+
+    operations = [
+        # При откате RemoveField тоже пересоздаёт таблицу — триггеры восстанавливаются после него
+        migrations.RunPython(migrations.RunPython.noop, restore_fts_triggers),
+        migrations.AddField(
+            model_name='post',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+    ]
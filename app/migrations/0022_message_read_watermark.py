@@ -0,0 +1,72 @@
+# Generated by Django 6.0rc1 on 2026-10-17 04:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, Min, Q
+
+
+def set_watermarks(apps, schema_editor):
+    Message = apps.get_model('app', 'Message')
+    Conversation = apps.get_model('app', 'Conversation')
+
+    # Отметка — перед первым непрочитанным сообщением; всё прочитано — последнее полученное
+    directions = Message.objects.order_by().values('recipient_id', 'sender_id').annotate(
+        last_id=Max('id'), first_unread_id=Min('id', filter=Q(is_read=False)))
+    marks = {}
+    for row in directions:
+        first_unread_id = row['first_unread_id']
+        marks[row['recipient_id'], row['sender_id']] = (
+            row['last_id'], first_unread_id - 1 if first_unread_id else row['last_id'])
+
+    changed = []
+    for conversation in Conversation.objects.only('id', 'user_id', 'contact_id').iterator():
+        mark = marks.get((conversation.user_id, conversation.contact_id))
+        if mark:
+            conversation.last_received_id, conversation.last_read_id = mark
+            changed.append(conversation)
+    Conversation.objects.bulk_update(changed, ['last_received_id', 'last_read_id'], batch_size=500)
+
+
+def restore_read_flags(apps, schema_editor):
+    Message = apps.get_model('app', 'Message')
+    Conversation = apps.get_model('app', 'Conversation')
+
+    for conversation in Conversation.objects.filter(last_received_id__gt=0).iterator():
+        incoming = Message.objects.filter(recipient_id=conversation.user_id, sender_id=conversation.contact_id)
+        incoming.filter(id__lte=conversation.last_read_id).update(is_read=True)
+        conversation.unread_count = incoming.filter(id__gt=conversation.last_read_id).count()
+        conversation.save(update_fields=['unread_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_post_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_received_id',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['recipient', 'sender', 'id'], name='message_watermark_idx'),
+        ),
+        migrations.RunPython(set_watermarks, restore_read_flags),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='unread_count',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0rc1 on 2026-10-17 05:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_likeevent'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'recipient', 'timestamp', 'id'], name='message_pair_timestamp_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0rc1 on 2026-10-17 05:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_message_pair_timestamp_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'path'], name='comment_post_depth_path_idx'),
+        ),
+    ]
@@ -286,10 +286,10 @@
 
 
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Least
 from django.contrib.auth.models import User
-from PIL import Image
-import os
+from django.utils import timezone
 
 
 class Post(models.Model):
@@ -297,36 +297,75 @@ class Post(models.Model):
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Последнее редактирование поста (валидатор условного GET в post_detail)
+    updated_at = models.DateTimeField(auto_now=True)
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    # Уменьшенные копии изображения (см. ImageJob), их выводит тег responsive_image
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # Денормализованные счётчики, их обновляют сигналы Like/Comment (app/signals.py),
+    # а лайки из представлений — app/toggles.py и буфер app/like_buffer.py
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    comment_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ('like_count', 'comment_count')
+    # Поля, которые пишут не через экземпляр: счётчики и список копий изображения (ImageJob)
+    EXTERNAL_FIELDS = COUNTER_FIELDS + ('image_variants',)
 
     def __str__(self):
         return self.title
 
     def get_like_count(self):
-        return self.likes.count()
+        return self.like_count
 
     def user_liked(self, user):
+        # Для списков постов используйте views.attach_viewer_state — один запрос на всю страницу
         return self.likes.filter(user=user).exists()
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Запоминаем загруженное имя файла, чтобы при сохранении не перечитывать пост из БД
+        if 'image' in field_names:
+            instance._loaded_image = values[field_names.index('image')]
+        return instance
+
     def delete(self, *args, **kwargs):
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
-        super().delete(*args, **kwargs)
+        image_name = self.image.name
+        result = super().delete(*args, **kwargs)
+        # Файлы постов, удалённых каскадом или через QuerySet.delete(), убирает manage.py gc_media
+        if image_name:
+            transaction.on_commit(lambda: self.image.storage.delete(image_name))
+        return result
 
     def save(self, *args, **kwargs):
-        if self.pk:
-            old_post = Post.objects.get(pk=self.pk)
-            if old_post.image and old_post.image != self.image:
-                if os.path.isfile(old_post.image.path):
-                    os.remove(old_post.image.path)
+        # Счётчики и список копий не перезаписываем устаревшими значениями из экземпляра
+        adding = self._state.adding
+        if not adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.EXTERNAL_FIELDS
+            ]
         super().save(*args, **kwargs)
 
+        old_image = getattr(self, '_loaded_image', None)
+        if old_image and old_image != self.image.name:
+            transaction.on_commit(lambda: self.image.storage.delete(old_image))
+        self._loaded_image = self.image.name
+        # Обработка нужна только новому файлу: обычное редактирование — один UPDATE
+        if self.image and (adding or old_image != self.image.name):
+            ImageJob.enqueue(self, 'image')
+
     def get_comment_count(self):
-        return self.comments.count()
+        return self.comment_count
 
     class Meta:
         verbose_name = 'Post'
         verbose_name_plural = 'Posts'
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='post_created_id_idx'),
+            # "Мои посты": страница постов автора без сортировки всех его постов
+            models.Index(fields=['author', 'created_at', 'id'], name='post_author_created_idx'),
+        ]
 
 
 class Like(models.Model):
@@ -343,12 +382,39 @@ class Like(models.Model):
         return f"{self.user.username} liked {self.post.title}"
 
 
+# Переключение лайка, ещё не перенесённое в Like и Post.like_count (app/like_buffer.py).
+# Событие пишется, только если состояние меняется, поэтому liked=True — это +1 к счётчику,
+# liked=False — минус один; последнее событие пары (user, post) — её текущее состояние
+class LikeEvent(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='like_events')
+    liked = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Like event'
+        verbose_name_plural = 'Like events'
+        indexes = [
+            # Последнее событие пары и сумма событий поста
+            models.Index(fields=['post', 'user', 'id'], name='likeevent_post_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} {'liked' if self.liked else 'unliked'} {self.post.title}"
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     create_at = models.DateTimeField(auto_now_add=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
+    # Материализованный путь: id предков и свой id с нулями слева через "/".
+    # Сортировка по path даёт порядок обхода дерева.
+    path = models.CharField(max_length=1000, blank=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+
+    PATH_SEGMENT_WIDTH = 10
 
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.title}"
@@ -356,6 +422,29 @@ class Comment(models.Model):
     class Meta:
         verbose_name = 'Comment'
         verbose_name_plural = 'Comments'
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+            # Корни веток поста по порядку, не проходя по ответам
+            models.Index(fields=['post', 'depth', 'path'], name='comment_post_depth_path_idx'),
+        ]
+
+    @classmethod
+    def path_segment(cls, pk):
+        return str(pk).zfill(cls.PATH_SEGMENT_WIDTH)
+
+    def subtree_upper_bound(self):
+        # Пути потомков начинаются с "path/", а "/" < "0" — все они меньше "path0"
+        return self.path + '0'
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            prefix = f"{self.parent.path}/" if self.parent_id else ''
+            self.path = prefix + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
 
 
 class CommentLike(models.Model):
@@ -375,6 +464,7 @@ class CommentLike(models.Model):
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="profile")
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    avatar_variants = models.JSONField(default=dict, blank=True, editable=False)
     birth_date = models.DateField(blank=True, null=True)
     first_name = models.CharField(max_length=30, blank=True)
     last_name = models.CharField(max_length=30, blank=True)
@@ -386,11 +476,9 @@ class UserProfile(models.Model):
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         if self.avatar:
-            img = Image.open(self.avatar.path)
-            if img.height > 300 or img.width > 300:
-                output_size = (300, 300)
-                img.thumbnail(output_size)
-                img.save(self.avatar.path)
+            # Уменьшение до 300px и копии разных размеров делает фоновый обработчик
+            # (manage.py process_image_jobs)
+            ImageJob.enqueue(self, 'avatar', max_size=300)
 
     class Meta:
         verbose_name = 'UserProfile'
@@ -407,6 +495,10 @@ class Favorite(models.Model):
         verbose_name = 'Favorite'
         verbose_name_plural = 'Favorites'
         ordering = ['-created_at']
+        indexes = [
+            # Страница избранного по времени добавления
+            models.Index(fields=['user', 'created_at', 'id'], name='favorite_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}'s favorite {self.post.title}"
@@ -418,7 +510,6 @@ class Message(models.Model):
     subject = models.CharField(max_length=200, blank=True)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
-    is_read = models.BooleanField(default=False)
 
     def __str__(self):
         return f"Сообщение от {self.sender.username} для {self.recipient.username}"
@@ -427,6 +518,83 @@ class Message(models.Model):
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['-timestamp']
+        indexes = [
+            # Непрочитанные от собеседника — диапазон id после отметки прочтения (Conversation.last_read_id)
+            models.Index(fields=['recipient', 'sender', 'id'], name='message_watermark_idx'),
+            # Страница переписки: последние N сообщений каждого направления по (timestamp, id)
+            models.Index(fields=['sender', 'recipient', 'timestamp', 'id'], name='message_pair_timestamp_idx'),
+        ]
+
+
+class ConversationQuerySet(models.QuerySet):
+    def with_unread_count(self):
+        # Число непрочитанных считается только там, где они есть (last_received_id > last_read_id)
+        unread = Message.objects.filter(
+            recipient=models.OuterRef('user'), sender=models.OuterRef('contact'), id__gt=models.OuterRef('last_read_id'),
+        ).order_by().values('recipient').annotate(count=models.Count('id')).values('count')
+        return self.annotate(unread_count=models.Case(
+            models.When(last_received_id__gt=models.F('last_read_id'), then=models.Subquery(unread)),
+            default=models.Value(0),
+        ))
+
+
+# Сводка переписки: по строке на каждого участника пары (user -> contact),
+# чтобы список диалогов был одним упорядоченным запросом по индексу.
+# Прочитанность — отметка last_read_id: всё от contact с большим id не прочитано.
+# Открыть переписку — обновить одну строку, а не флаг у каждого сообщения.
+class Conversation(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversations')
+    contact = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # id последнего сообщения от contact и последнего прочитанного из них
+    last_received_id = models.PositiveBigIntegerField(default=0)
+    last_read_id = models.PositiveBigIntegerField(default=0)
+
+    objects = ConversationQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Переписка {self.user.username} с {self.contact.username}"
+
+    class Meta:
+        unique_together = ('user', 'contact')
+        verbose_name = 'Conversation'
+        verbose_name_plural = 'Conversations'
+        indexes = [
+            models.Index(fields=['user', '-last_message_at'], name='conversation_inbox_idx'),
+            # Частичный индекс: счётчик непрочитанных смотрит только отстающие отметки
+            models.Index(fields=['user'], condition=models.Q(last_received_id__gt=models.F('last_read_id')),
+                         name='conversation_unread_idx'),
+        ]
+
+    @property
+    def has_unread(self):
+        return self.last_received_id > self.last_read_id
+
+    @classmethod
+    def record_message(cls, message):
+        # Отправителю новое сообщение непрочитанным не считается, получателю — считается.
+        # Каждая сторона — один INSERT ... ON CONFLICT DO UPDATE, есть строка или нет
+        sides = {(message.sender_id, message.recipient_id): {}}
+        sides[(message.recipient_id, message.sender_id)] = {'last_received_id': message.pk}
+        for (user_id, contact_id), received in sides.items():
+            values = {'last_message': message, 'last_message_at': message.timestamp, **received}
+            cls.objects.bulk_create(
+                [cls(user_id=user_id, contact_id=contact_id, **values)],
+                update_conflicts=True,
+                unique_fields=['user', 'contact'],
+                update_fields=list(values),
+            )
+
+    @classmethod
+    def mark_read(cls, user, contact, message_id=None):
+        # Сдвигает отметку до message_id (по умолчанию — до последнего полученного).
+        # Одна строка и ни одной записи, если всё уже прочитано; возвращает, сдвинулась ли отметка
+        rows = cls.objects.filter(user=user, contact=contact, last_read_id__lt=models.F('last_received_id'))
+        if message_id is None:
+            return rows.update(last_read_id=models.F('last_received_id')) > 0
+        return rows.filter(last_read_id__lt=message_id).update(
+            last_read_id=Least(models.Value(message_id), models.F('last_received_id'))) > 0
 
 
 class Category(models.Model):
@@ -441,21 +609,58 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_primary_image(self):
+        # Главное изображение каждого товара (или первое по order) — одним запросом на всю страницу
+        return self.prefetch_related(models.Prefetch(
+            'images',
+            queryset=ProductImage.objects.order_by('-is_primary', 'order', 'id')[:1],
+            to_attr='primary_images',
+        ))
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products')
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    @property
+    def primary_image(self):
+        # Берём из prefetch (with_primary_image() или prefetch_related('images')), иначе — запрос
+        if hasattr(self, 'primary_images'):
+            return self.primary_images[0] if self.primary_images else None
+        if 'images' in getattr(self, '_prefetched_objects_cache', {}):
+            images = sorted(self.images.all(), key=lambda image: (not image.is_primary, image.order, image.id))
+            return images[0] if images else None
+        return self.images.order_by('-is_primary', 'order', 'id').first()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.image:
+            ImageJob.enqueue(self, 'image', max_size=800)
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
+        # Каталог: фильтр по категории + сортировка по цене/новизне, keyset по id
+        indexes = [
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_category_created_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['created_at', 'id'], name='product_created_idx'),
+            # Last-Modified страниц магазина — MAX(updated_at)
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+        ]
 
 
 class Order(models.Model):
@@ -484,6 +689,7 @@ class Order(models.Model):
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_primary = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
 
@@ -494,15 +700,77 @@ class ProductImage(models.Model):
         verbose_name = 'ProductImage'
         verbose_name_plural = 'ProductImages'
         ordering = ['order']
+        constraints = [
+            # Не больше одного главного изображения у товара
+            models.UniqueConstraint(fields=['product'], condition=models.Q(is_primary=True),
+                                    name='productimage_one_primary'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'order', 'id'], name='productimage_order_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            if self.is_primary:
+                # Новое главное изображение снимает флаг с прежнего
+                ProductImage.objects.filter(product_id=self.product_id, is_primary=True) \
+                    .exclude(pk=self.pk).update(is_primary=False)
+            super().save(*args, **kwargs)
         if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
+            ImageJob.enqueue(self, 'image', max_size=800)
+
+
+# Очередь фоновой обработки изображений: уменьшение оригинала до max_size (если задан)
+# и копии разных размеров в <поле>_variants. Задача привязана к имени файла,
+# поэтому повторная постановка того же файла ничего не добавляет.
+class ImageJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    ]
+
+    model_label = models.CharField(max_length=100)
+    object_id = models.PositiveBigIntegerField()
+    field_name = models.CharField(max_length=100)
+    source = models.CharField(max_length=255)
+    max_size = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.model_label}#{self.object_id}.{self.field_name} ({self.status})"
+
+    class Meta:
+        unique_together = ('model_label', 'object_id', 'field_name', 'source')
+        verbose_name = 'ImageJob'
+        verbose_name_plural = 'ImageJobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='imagejob_queue_idx'),
+        ]
+
+    @classmethod
+    def enqueue(cls, instance, field_name, max_size=None):
+        source = getattr(instance, field_name).name
+        job, created = cls.objects.get_or_create(
+            model_label=instance._meta.label,
+            object_id=instance.pk,
+            field_name=field_name,
+            source=source,
+            defaults={'max_size': max_size},
+        )
+        # Список копий мог быть затёрт сохранением устаревшего экземпляра — пересобираем
+        # (файлы копий уже на диске, задача только перепишет список)
+        variants = getattr(instance, f'{field_name}_variants', None)
+        if not created and job.status == 'done' and variants is not None and variants.get('source') != source:
+            cls.objects.filter(pk=job.pk, status='done').update(status='pending', attempts=0, run_after=timezone.now())
+        return job
 
 
 
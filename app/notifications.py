@@ -0,0 +1,71 @@
+import asyncio
+import json
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .caching import get_unread_count
+from .realtime import notifications
+
+
+# Поток уведомлений пользователя в формате Server-Sent Events (представление notifications_stream).
+# Сессия и пользователь проверяются один раз при подключении; дальше — только события
+# из памяти процесса и, при изменении непрочитанных, чтение счётчика из кеша.
+# Пачка событий уходит не чаще раза в NOTIFICATIONS_MIN_INTERVAL секунд: всё, что пришло
+# за это время, склеивается — один счётчик непрочитанных, по одному событию на пост.
+RETRY_MS = 5000
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def coalesce(events):
+    # Возвращает (нужно ли перечитать счётчик непрочитанных, [(событие, данные)])
+    refresh_unread = False
+    posts = defaultdict(lambda: {'count': 0})
+    for event in events:
+        if event['type'] in ('unread', 'resync'):
+            # resync — очередь переполнилась и события потеряны: хотя бы счётчик будет верным
+            refresh_unread = True
+        elif event['type'] in ('like', 'comment'):
+            data = posts[event['type'], event['post_id']]
+            data.update(post_id=event['post_id'], title=event['title'])
+            data['count'] += 1
+    return refresh_unread, [(kind, data) for (kind, post_id), data in posts.items()]
+
+
+async def notification_stream(user_id):
+    loop = asyncio.get_running_loop()
+    subscription = notifications.subscribe(user_id)
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        unread = await sync_to_async(get_unread_count)(user_id)
+        yield sse('unread', {'count': unread})
+        sent_at = loop.time()
+        while True:
+            try:
+                first = await asyncio.wait_for(subscription.get(), settings.NOTIFICATIONS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # Комментарий держит соединение живым через прокси
+                yield ": keepalive\n\n"
+                continue
+            # Клиент получил пачку недавно — ждём, пока накопятся остальные события
+            delay = sent_at + settings.NOTIFICATIONS_MIN_INTERVAL - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            events = [first]
+            while not subscription.queue.empty():
+                events.append(subscription.queue.get_nowait())
+
+            refresh_unread, batch = coalesce(events)
+            if refresh_unread:
+                count = await sync_to_async(get_unread_count)(user_id)
+                if count != unread:
+                    unread = count
+                    batch.insert(0, ('unread', {'count': count}))
+            if batch:
+                yield ''.join(sse(event, data) for event, data in batch)
+                sent_at = loop.time()
+    finally:
+        notifications.unsubscribe(subscription)
@@ -0,0 +1,93 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+# Keyset-пагинация по (поле, id): по умолчанию от новых к старым,
+# стоимость страницы не зависит от того, насколько далеко пролистали.
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPage:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(direction, value, pk):
+    value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    raw = json.dumps([direction, value, pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    # Значение поля возвращается строкой; в тип поля его приводит paginate_by_cursor
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        direction, value, pk = json.loads(raw)
+        if direction not in (NEXT, PREVIOUS) or not isinstance(value, str):
+            return None
+        return direction, value, int(pk)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+
+
+def paginate_by_cursor(queryset, cursor=None, field='created_at', page_size=None, descending=True):
+    page_size = page_size or settings.POSTS_PAGE_SIZE
+    decoded = decode_cursor(cursor) if cursor else None
+    if decoded is not None:
+        direction, value, pk = decoded
+        try:
+            value = queryset.model._meta.get_field(field).to_python(value)
+        except ValidationError:
+            # Курсор от другой сортировки — начинаем с первой страницы
+            decoded = None
+
+    # Порядок страницы и "обратный" порядок для перехода назад
+    forward, backward = ('lt', 'gt') if descending else ('gt', 'lt')
+    forward_order = (f'-{field}', '-id') if descending else (field, 'id')
+    backward_order = (field, 'id') if descending else (f'-{field}', '-id')
+
+    if decoded is None:
+        rows = list(queryset.order_by(*forward_order)[:page_size + 1])
+        items = rows[:page_size]
+        has_next, has_previous = len(rows) > page_size, False
+    elif direction == NEXT:
+        rows = list(queryset.filter(
+            Q(**{f'{field}__{forward}': value}) | Q(**{field: value, f'id__{forward}': pk})
+        ).order_by(*forward_order)[:page_size + 1])
+        items = rows[:page_size]
+        has_next, has_previous = len(rows) > page_size, True
+    else:
+        rows = list(queryset.filter(
+            Q(**{f'{field}__{backward}': value}) | Q(**{field: value, f'id__{backward}': pk})
+        ).order_by(*backward_order)[:page_size + 1])
+        items = rows[:page_size][::-1]
+        has_next, has_previous = True, len(rows) > page_size
+
+    next_cursor = previous_cursor = None
+    if items and has_next:
+        next_cursor = encode_cursor(NEXT, getattr(items[-1], field), items[-1].pk)
+    if items and has_previous:
+        previous_cursor = encode_cursor(PREVIOUS, getattr(items[0], field), items[0].pk)
+    return CursorPage(items, next_cursor, previous_cursor)
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from .caching import reset_unread_count
+from .models import Conversation
+
+
+# Доставка событий подключённым клиентам: WebSocket личных сообщений (app/websocket.py)
+# и поток уведомлений Server-Sent Events (app/notifications.py).
+# Подписки живут в памяти процесса, как и кеш LocMem: отдельный брокер не нужен,
+# но событие получают только клиенты, подключённые к тому же процессу.
+# Публиковать можно из любого потока — синхронные представления под ASGI работают
+# в пуле потоков, а очереди подписчиков принадлежат циклу событий.
+class Subscription:
+    def __init__(self, user_id, loop, maxsize):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, event):
+        # Вызывается в потоке цикла событий. Клиент, который не успевает читать,
+        # получает вместо накопившихся событий одно "resync" и перечитывает страницу
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = {'type': 'resync'}
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, asyncio.get_running_loop(), settings.REALTIME_QUEUE_SIZE)
+        with self.lock:
+            self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def connections(self):
+        with self.lock:
+            return sum(map(len, self.subscriptions.values()))
+
+    def publish(self, user_id, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # Цикл событий уже закрыт — подписка умерла вместе с ним
+                self.unsubscribe(subscription)
+
+
+# Личные сообщения и отметки о прочтении
+broker = Broker()
+# Уведомления: изменился счётчик непрочитанных, новый лайк или комментарий к посту
+notifications = Broker()
+
+
+def publish_on_commit(user_ids, event, channel=broker):
+    # Клиент не должен увидеть событие, которое ещё может откатиться
+    transaction.on_commit(lambda: [channel.publish(user_id, event) for user_id in user_ids])
+
+
+def notify_on_commit(user_id, event):
+    publish_on_commit([user_id], event, channel=notifications)
+
+
+def message_event(message):
+    return {
+        'type': 'message',
+        'id': message.pk,
+        'sender': message.sender_id,
+        'sender_username': message.sender.username,
+        'recipient': message.recipient_id,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def mark_conversation_read(user_id, contact_id, message_id=None):
+    # Сдвигает отметку прочтения (см. Conversation.mark_read) и отправляет собеседнику
+    # уведомление о прочтении. Если читать было нечего — ни записей, ни событий
+    if not Conversation.mark_read(user_id, contact_id, message_id):
+        return False
+    reset_unread_count(user_id)
+    publish_on_commit([contact_id], {'type': 'read', 'reader': user_id})
+    notify_on_commit(user_id, {'type': 'unread'})
+    return True
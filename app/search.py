@@ -0,0 +1,72 @@
+import re
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+
+# Полнотекстовый поиск на SQLite FTS5. Таблицы app_post_fts, app_comment_fts и app_product_fts —
+# индексы с внешним содержимым (app_post, app_comment, app_product); их синхронизируют триггеры
+# из миграции, поэтому индекс не отстаёт и при QuerySet.update()/delete() и каскадах.
+# Миграция, пересоздающая одну из этих таблиц в SQLite (AddField, AlterField), удаляет и
+# её триггеры — их нужно создать заново в той же миграции (см. 0021_post_updated_at).
+SNIPPET_START, SNIPPET_END = '\x02', '\x03'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+SEARCH_SQL = """
+    SELECT 'post' AS kind, f.rowid AS object_id, f.rowid AS post_id,
+           snippet(app_post_fts, -1, %s, %s, '…', 16) AS snippet, f.rank AS rank
+    FROM app_post_fts f
+    WHERE app_post_fts MATCH %s
+    UNION ALL
+    SELECT 'comment', c.id, c.post_id,
+           snippet(app_comment_fts, 0, %s, %s, '…', 16), f.rank
+    FROM app_comment_fts f JOIN app_comment c ON c.id = f.rowid
+    WHERE app_comment_fts MATCH %s
+    ORDER BY rank
+    LIMIT %s OFFSET %s
+"""
+
+
+def fts_query(text):
+    # Пользовательский ввод превращаем в набор слов в кавычках (без операторов FTS5);
+    # последнее слово ищется по префиксу
+    tokens = TOKEN_RE.findall(text)
+    if not tokens:
+        return ''
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    return mark_safe(escape(snippet).replace(SNIPPET_START, '<mark>').replace(SNIPPET_END, '</mark>'))
+
+
+def search(text, limit, offset=0):
+    query = fts_query(text)
+    if not query:
+        return []
+    markers = [SNIPPET_START, SNIPPET_END]
+    with connection.cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [*markers, query, *markers, query, limit, offset])
+        rows = cursor.fetchall()
+    return [
+        {'kind': kind, 'object_id': object_id, 'post_id': post_id, 'snippet': highlight(snippet), 'rank': rank}
+        for kind, object_id, post_id, snippet, rank in rows
+    ]
+
+
+def post_ids_sql(text):
+    # Подзапрос id постов для фильтра id__in=RawSQL(...)
+    return "SELECT rowid FROM app_post_fts WHERE app_post_fts MATCH %s", [fts_query(text)]
+
+
+def product_ids_sql(text):
+    return "SELECT rowid FROM app_product_fts WHERE app_product_fts MATCH %s", [fts_query(text)]
+
+
+def rebuild_index():
+    with connection.cursor() as cursor:
+        for table in ('app_post_fts', 'app_comment_fts', 'app_product_fts'):
+            cursor.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
@@ -0,0 +1,128 @@
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Post, Like, Comment, Message, Conversation, UserProfile, ImageJob, Product, ProductImage, Category
+from .caching import (incr_unread_count, bump_comments_version, bump_comments_versions, bump_post_version,
+                      bump_profile_version, bump_shop_version)
+from .realtime import publish_on_commit, notify_on_commit, message_event
+
+
+# Счётчики лайков и комментариев на Post.
+# post_delete срабатывает и при каскадном удалении, и при удалении из админки.
+def deleting_post(origin):
+    # Каскад от удаления самого поста: счётчики удаляемого поста обновлять незачем
+    return isinstance(origin, Post) or getattr(origin, 'model', None) is Post
+
+
+@receiver(post_save, sender=Like)
+def like_created(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(like_count=F('like_count') + 1)
+        bump_post_version(instance.post_id)
+
+
+@receiver(post_delete, sender=Like)
+def like_deleted(sender, instance, origin=None, **kwargs):
+    if deleting_post(origin):
+        return
+    Post.objects.filter(pk=instance.post_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+    bump_post_version(instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(comment_count=F('comment_count') + 1)
+        bump_post_version(instance.post_id)
+        if instance.author_id != instance.post.author_id:
+            notify_on_commit(instance.post.author_id, {
+                'type': 'comment', 'post_id': instance.post_id, 'title': instance.post.title,
+            })
+    bump_comments_version(instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, origin=None, **kwargs):
+    if deleting_post(origin):
+        return
+    Post.objects.filter(pk=instance.post_id, comment_count__gt=0).update(comment_count=F('comment_count') - 1)
+    bump_post_version(instance.post_id)
+    bump_comments_version(instance.post_id)
+
+
+# Версии кешированных карточек постов (см. caching.post_card_version)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, instance, **kwargs):
+    bump_post_version(instance.pk)
+
+
+# Имя и аватар пользователя видны на карточках его постов и в ветках комментариев
+# (кешированные фрагменты и ETag страницы поста держатся на версии комментариев поста)
+def bump_user_appearance(user_id):
+    bump_profile_version(user_id)
+    bump_comments_versions(Comment.objects.filter(author_id=user_id).values_list('post_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_changed(sender, instance, **kwargs):
+    bump_user_appearance(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Частичные сохранения пропускаем: вход обновляет только last_login,
+    # а форма профиля сохраняет и профиль — его сигнал сбросит версии сам
+    if created or update_fields is not None:
+        return
+    bump_user_appearance(instance.pk)
+
+
+# Версия кеша страниц магазина; изменения галереи отражаются в Product.updated_at
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def shop_changed(sender, instance, **kwargs):
+    bump_shop_version()
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    touch_product(instance.product_id)
+
+
+def touch_product(product_id):
+    Product.objects.filter(pk=product_id).update(updated_at=timezone.now())
+    bump_shop_version()
+
+
+@receiver(post_save, sender=ImageJob)
+def image_job_finished(sender, instance, **kwargs):
+    # Копии изображений записываются через update(), без сигналов модели
+    if instance.status != 'done':
+        return
+    if instance.model_label == Product._meta.label:
+        touch_product(instance.object_id)
+    elif instance.model_label == ProductImage._meta.label:
+        product_id = ProductImage.objects.filter(pk=instance.object_id).values_list('product_id', flat=True).first()
+        if product_id is not None:
+            touch_product(product_id)
+    elif instance.model_label == Post._meta.label:
+        bump_post_version(instance.object_id)
+    elif instance.model_label == UserProfile._meta.label:
+        user_id = UserProfile.objects.filter(pk=instance.object_id).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            bump_user_appearance(user_id)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    if created:
+        Conversation.record_message(instance)
+        incr_unread_count(instance.recipient_id)
+        publish_on_commit([instance.sender_id, instance.recipient_id], message_event(instance))
+        notify_on_commit(instance.recipient_id, {'type': 'unread'})
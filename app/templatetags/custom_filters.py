@@ -1,13 +1,74 @@
 from django import template
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from app.caching import comments_version, COMMENT_FRAGMENT_TIMEOUT, post_card_version, POST_CARD_TIMEOUT
 
 register = template.Library()
 
 
 @register.filter
 def mul(value, args):
-    print(value, args)
-
     try:
         return value * args
     except (TypeError, ValueError):
-        return ''
\ No newline at end of file
+        return ''
+
+
+@register.simple_tag
+def comment_thread(comments):
+    # Плоский список комментариев в порядке дерева (отступ по comment.depth) без рекурсивных include.
+    # Готовый HTML кешируется; версия меняется при любом изменении комментариев поста.
+    if not comments:
+        return ''
+    first, last = comments[0], comments[-1]
+    key = f'comment_thread:{first.post_id}:{comments_version(first.post_id)}:{first.pk}:{last.pk}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('app/comment_thread.html', {'comments': comments})
+        cache.set(key, html, COMMENT_FRAGMENT_TIMEOUT)
+    return mark_safe(html)
+
+
+# Метка в кешированной карточке, на место которой подставляется отметка лайка текущего пользователя
+POST_CARD_LIKE_MARKER = '<!--post-card-like-->'
+
+
+@register.simple_tag
+def post_card(post):
+    # Общая для всех пользователей карточка поста. Отметки "нравится"/"в избранном"
+    # в кеш не попадают: избранное выводится снаружи, сердечко подставляется в метку.
+    key = f'post_card:{post.pk}:{post_card_version(post)}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string('app/post_card.html', {'post': post, 'like_marker': mark_safe(POST_CARD_LIKE_MARKER)})
+        cache.set(key, html, POST_CARD_TIMEOUT)
+    return mark_safe(html.replace(POST_CARD_LIKE_MARKER, '❤️' if getattr(post, 'is_liked', False) else '🤍'))
+
+
+@register.simple_tag
+def responsive_image(field_file, variants, sizes='100vw', **attrs):
+    # <picture> с WebP и srcset по копиям из <поле>_variants. Пока копии не готовы
+    # (или список относится к другому файлу) — обычный <img> с оригиналом.
+    if not field_file:
+        return ''
+    attributes = format_html_join(' ', '{}="{}"', attrs.items())
+    if not variants or variants.get('source') != field_file.name:
+        return format_html('<img src="{}" {}>', field_file.url, attributes)
+
+    srcsets = {}
+    for variant in variants['variants']:
+        srcsets.setdefault(variant['format'], []).append(
+            f"{default_storage.url(variant['name'])} {variant['width']}w")
+    fallback_format = next(fmt for fmt in srcsets if fmt != 'webp')
+    fallback = srcsets[fallback_format]
+    webp_source = ''
+    if 'webp' in srcsets:
+        webp_source = format_html('<source type="image/webp" srcset="{}" sizes="{}">',
+                                  ', '.join(srcsets['webp']), sizes)
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        webp_source, fallback[-1].rsplit(' ', 1)[0], ', '.join(fallback), sizes, attributes,
+    )
@@ -1,3 +1,1057 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from urllib.parse import urlsplit
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.template import Context, Template
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import urls
+from . import like_buffer, toggles
+from .caching import POST_CARDS_GENERATION_KEY, SHOP_VERSION_KEY, post_card_version, versions
+from .images import build_variants, claim_job, process_job
+from .middleware import QueryBudgetMiddleware, duplicate_queries
+from .realtime import Subscription, broker
+from .templatetags.custom_filters import POST_CARD_LIKE_MARKER
+from .websocket import InProcessClient, CLOSE_FORBIDDEN, CLOSE_UNAUTHORIZED
+from .models import (UserProfile, Post, Like, LikeEvent, Comment, Favorite, Message, Conversation, Category, Product,
+                     ProductImage, ImageJob)
+
+
+class QueryBudgetMixin:
+    # Запрос через тестовый клиент с проверкой бюджета, объявленного на представлении (@query_budget)
+    def request_within_budget(self, method, url, data=None, **extra):
+        match = resolve(urlsplit(url).path)
+        budget = getattr(match.func, 'query_budget', None)
+        self.assertIsNotNone(budget, f"{match.view_name}: не объявлен @query_budget")
+
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data or {}, **extra)
+
+        statements = [query['sql'] for query in queries.captured_queries]
+        if len(statements) > budget:
+            duplicates = duplicate_queries(statements)
+            self.fail(
+                f"{method.upper()} {url} ({match.view_name}): {len(statements)} запросов при бюджете {budget}\n"
+                + "\n".join(f"{n}. {sql}" for n, sql in enumerate(statements, 1))
+                + (f"\nПовторяются: {duplicates}" if duplicates else "")
+            )
+        return response
+
+    def assert_indexed(self, url, *indexes, data=None, sorted_by_index=False):
+        # EXPLAIN QUERY PLAN каждого SELECT страницы: ни одного полного прохода по таблице,
+        # и основной запрос идёт по ожидаемым индексам. sorted_by_index — ещё и без сортировки
+        # во временном B-дереве: строки уже идут в порядке индекса
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, data or {}).status_code, 200)
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plans += [(row[-1], query['sql']) for row in cursor.fetchall()]
+        for step, sql in plans:
+            scan = re.fullmatch(r'SCAN (\S+)(?: LEFT-JOIN)?', step)
+            # (subquery-N) и qualify — уже отобранные строки подзапроса с оконной функцией
+            if scan and not scan.group(1).startswith('(') and scan.group(1) != 'qualify':
+                self.fail(f"GET {url}: полный проход по {scan.group(1)}\n{sql}")
+            if sorted_by_index and step.startswith('USE TEMP B-TREE'):
+                self.fail(f"GET {url}: {step}\n{sql}")
+        used = ' '.join(step for step, sql in plans)
+        for index in indexes:
+            self.assertIn(f' INDEX {index} ', f'{used} ', f"GET {url}: не используется {index}")
+
+
+class RouteQueryBudgetTests(QueryBudgetMixin, TestCase):
+    # Данных больше, чем по одному на страницу: запрос на каждый объект сразу выйдет за бюджет
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader', password='secret-pass-1')
+        cls.author = User.objects.create_user('author', password='secret-pass-2')
+        UserProfile.objects.create(user=cls.user)
+        UserProfile.objects.create(user=cls.author)
+
+        cls.posts = [
+            Post.objects.create(title=f"Пост {i}", content="Текст поста", author=cls.author if i % 2 else cls.user)
+            for i in range(15)
+        ]
+        cls.post = cls.posts[-1]
+        cls.own_post = cls.posts[0]
+        cls.other_post = cls.posts[-2]
+        for post in cls.posts[:6]:
+            Like.objects.create(post=post, user=cls.user)
+            Favorite.objects.create(post=post, user=cls.user)
+        for _ in range(3):
+            root = Comment.objects.create(post=cls.post, author=cls.author, content="Комментарий")
+            for _ in range(4):
+                Comment.objects.create(post=cls.post, author=cls.user, content="Ответ", parent=root)
+        cls.root_comment = root
+
+        for i in range(5):
+            Message.objects.create(sender=cls.author, recipient=cls.user, content=f"Сообщение {i}")
+            Message.objects.create(sender=cls.user, recipient=cls.author, content=f"Ответ {i}")
+
+        cls.category = Category.objects.create(name="Посуда")
+        cls.products = [
+            Product.objects.create(name=f"Товар {i}", description="Описание", category=cls.category, price=Decimal(i * 100))
+            for i in range(10)
+        ]
+        for product in cls.products:
+            ProductImage.objects.create(product=product, image=f'product_images/{product.pk}.jpg', is_primary=True)
+            ProductImage.objects.create(product=product, image=f'product_images/{product.pk}-2.jpg', order=1)
+
+    def setUp(self):
+        # Бюджеты — для холодного кеша
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_every_route_declares_budget(self):
+        for pattern in urls.urlpatterns:
+            self.assertIsInstance(pattern, URLPattern)
+            self.assertIsNotNone(getattr(pattern.callback, 'query_budget', None), pattern.name)
+
+    def test_home(self):
+        response = self.request_within_budget('get', reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        response = self.request_within_budget('get', reverse('home'), {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(response.status_code, 200)
+
+    def test_my_posts(self):
+        self.assertEqual(self.request_within_budget('get', reverse('my_posts')).status_code, 200)
+
+    def test_favorites(self):
+        self.assertEqual(self.request_within_budget('get', reverse('favorites')).status_code, 200)
+
+    def test_query_plans(self):
+        # conversation_unread_idx — счётчик непрочитанных в шапке любой страницы
+        self.assert_indexed(reverse('home'), 'post_created_id_idx', 'conversation_unread_idx')
+        self.assert_indexed(reverse('my_posts'), 'post_author_created_idx')
+        self.assert_indexed(reverse('favorites'), 'favorite_user_created_idx')
+        self.assert_indexed(reverse('post_detail', args=[self.post.id]), 'comment_post_depth_path_idx',
+                            'comment_post_path_idx', sorted_by_index=True)
+        self.assert_indexed(reverse('messages_list'), 'conversation_inbox_idx', 'message_watermark_idx')
+        url = reverse('messages_list', args=[self.author.id])
+        self.assert_indexed(url, 'message_pair_timestamp_idx', sorted_by_index=True)
+        with override_settings(MESSAGES_PAGE_SIZE=3):
+            cursor = self.client.get(url).context['older_cursor']
+            self.assert_indexed(reverse('messages_older', args=[self.author.id]), 'message_pair_timestamp_idx',
+                                data={'cursor': cursor}, sorted_by_index=True)
+        self.assert_indexed(reverse('shop_home'), 'product_created_idx')
+        self.assert_indexed(reverse('shop_category', args=[self.category.id]), 'product_category_created_idx')
+        self.assert_indexed(reverse('shop_product_detail', args=[self.products[0].id]), 'productimage_order_idx')
+
+    def test_search(self):
+        response = self.request_within_budget('get', reverse('search'), {'q': 'пост'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['results'])
+
+    def test_post_detail(self):
+        self.assertEqual(self.request_within_budget('get', reverse('post_detail', args=[self.post.id])).status_code, 200)
+
+    def test_comment_threads(self):
+        url = reverse('comment_threads', args=[self.post.id])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+
+    def test_comment_replies(self):
+        url = reverse('comment_replies', args=[self.post.id, self.root_comment.id])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+
+    def test_post_create(self):
+        self.assertEqual(self.request_within_budget('get', reverse('post_create')).status_code, 200)
+        response = self.request_within_budget('post', reverse('post_create'), {'title': "Новый", 'content': "Текст"})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+    def test_post_edit(self):
+        url = reverse('post_edit', args=[self.own_post.id])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+        response = self.request_within_budget('post', url, {'title': "Изменён", 'content': "Текст"})
+        self.assertRedirects(response, reverse('post_detail', args=[self.own_post.id]), fetch_redirect_response=False)
+
+    def test_post_delete(self):
+        response = self.request_within_budget('post', reverse('post_delete', args=[self.own_post.id]))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertFalse(Post.objects.filter(pk=self.own_post.pk).exists())
+
+    def test_toggle_like(self):
+        url = reverse('toggle_like', args=[self.other_post.id])
+        self.assertEqual(self.request_within_budget('post', url).status_code, 302)
+        self.assertEqual(self.request_within_budget('post', url).status_code, 302)
+
+    def test_toggle_favorite(self):
+        url = reverse('toggle_favorite', args=[self.other_post.id])
+        self.assertEqual(self.request_within_budget('post', url).status_code, 302)
+        self.assertEqual(self.request_within_budget('post', url).status_code, 302)
+
+    def test_toggle_json(self):
+        url = reverse('toggle_like', args=[self.other_post.id])
+        for state, liked, like_count in (('1', True, 1), ('1', True, 1), ('0', False, 0)):
+            response = self.request_within_budget('post', url, {'state': state}, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.json(), {'liked': liked, 'like_count': like_count})
+        like_buffer.flush()
+        self.assertEqual(Post.objects.get(pk=self.other_post.pk).like_count, 0)
+
+        url = reverse('toggle_favorite', args=[self.other_post.id])
+        response = self.request_within_budget('post', url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {'favorite': True})
+        self.assertTrue(Favorite.objects.filter(user=self.user, post=self.other_post).exists())
+        url = reverse('toggle_favorite', args=[self.own_post.id])
+        response = self.request_within_budget('post', url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    @override_settings(POSTS_PAGE_SIZE=3)
+    def test_favorites_pages_after_toggle(self):
+        # Строки из toggle_favorite (сырой INSERT) сравниваются по created_at наравне с созданными ORM
+        toggled = [post for post in self.posts[6:] if post.author_id == self.author.pk]
+        for post in toggled:
+            self.client.post(reverse('toggle_favorite', args=[post.id]), {'state': '1'})
+        favorite = Favorite.objects.get(user=self.user, post=toggled[0])
+        self.assertTrue(Favorite.objects.filter(pk=favorite.pk, created_at__lte=favorite.created_at).exists())
+
+        seen, cursor = [], None
+        while True:
+            page = self.client.get(reverse('favorites'), {'cursor': cursor} if cursor else {}).context['page']
+            seen += [entry.post_id for entry in page]
+            cursor = page.next_cursor
+            if not cursor:
+                break
+        expected = Favorite.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('post_id', flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(len(seen), 6 + len(toggled))
+
+    def test_add_comment(self):
+        response = self.request_within_budget('post', reverse('add_comment', args=[self.post.id]), {'content': "Ещё"})
+        self.assertRedirects(response, reverse('post_detail', args=[self.post.id]), fetch_redirect_response=False)
+
+    def test_messages_list(self):
+        self.assertEqual(self.request_within_budget('get', reverse('messages_list')).status_code, 200)
+        url = reverse('messages_list', args=[self.author.id])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+
+    def test_opening_conversation_writes_one_row(self):
+        self.assertEqual(self.client.get(reverse('messages_list')).context['unread_count'], 5)
+        url = reverse('messages_list', args=[self.author.id])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request_within_budget('get', url)
+        writes = [query['sql'] for query in queries.captured_queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('UPDATE "app_conversation"', writes[0])
+        self.assertEqual(response.context['unread_count'], 0)
+
+        # Всё прочитано — ни одной записи; новое сообщение снова непрочитано
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')])
+        Message.objects.create(sender=self.author, recipient=self.user, content="Ещё")
+        self.assertEqual(self.client.get(reverse('messages_list')).context['unread_count'], 1)
+
+    @override_settings(MESSAGES_PAGE_SIZE=4)
+    def test_messages_older(self):
+        response = self.request_within_budget('get', reverse('messages_list', args=[self.author.id]))
+        shown = response.context['selected_conversation']
+        self.assertEqual([message.content for message in shown], ["Сообщение 3", "Ответ 3", "Сообщение 4", "Ответ 4"])
+
+        url = reverse('messages_older', args=[self.author.id])
+        cursor = response.context['older_cursor']
+        response = self.request_within_budget('get', url, {'cursor': cursor})
+        self.assertContains(response, "Сообщение 1")
+        self.assertContains(response, 'load-older-messages')
+
+        response = self.request_within_budget('get', url, {'cursor': cursor}, HTTP_ACCEPT='application/json')
+        data = response.json()
+        self.assertEqual([message['content'] for message in data['messages']],
+                         ["Сообщение 1", "Ответ 1", "Сообщение 2", "Ответ 2"])
+        data = self.request_within_budget('get', url, {'cursor': data['older_cursor']},
+                                          HTTP_ACCEPT='application/json').json()
+        self.assertEqual([message['content'] for message in data['messages']], ["Сообщение 0", "Ответ 0"])
+        self.assertIsNone(data['older_cursor'])
+
+        # Одинаковое время у всех сообщений: порядок и курсор держатся на id
+        Message.objects.update(timestamp=timezone.now())
+        ids, cursor = [], None
+        while True:
+            data = self.client.get(url, {'cursor': cursor} if cursor else {}, HTTP_ACCEPT='application/json').json()
+            ids += [message['id'] for message in reversed(data['messages'])]
+            cursor = data['older_cursor']
+            if not cursor:
+                break
+        self.assertEqual(ids, sorted(Message.objects.values_list('id', flat=True), reverse=True))
+
+    def test_send_message(self):
+        url = reverse('send_message', args=[self.author.id])
+        response = self.request_within_budget('post', url, {'content': "Привет"})
+        self.assertRedirects(response, reverse('messages_list', args=[self.author.id]), fetch_redirect_response=False)
+
+        # Первое сообщение новому собеседнику: сводок переписки ещё нет ни у одной стороны
+        stranger = User.objects.create_user('stranger')
+        response = self.request_within_budget('post', reverse('send_message', args=[stranger.id]), {'content': "Привет"})
+        self.assertEqual(response.status_code, 302)
+        conversation = Conversation.objects.get(user=stranger, contact=self.user)
+        self.assertEqual(conversation.last_received_id, Message.objects.get(recipient=stranger).pk)
+        self.assertEqual(Conversation.objects.get(user=self.user, contact=stranger).last_received_id, 0)
+
+    def test_notifications_stream(self):
+        # Через WSGI поток не открывается; под ASGI — см. NotificationStreamTests
+        self.assertEqual(self.request_within_budget('get', reverse('notifications_stream')).status_code, 204)
+
+    def test_profile_view(self):
+        url = reverse('profile_view', args=[self.author.username])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+
+    def test_profile_edit(self):
+        self.assertEqual(self.request_within_budget('get', reverse('profile_edit')).status_code, 200)
+        response = self.request_within_budget('post', reverse('profile_edit'), {
+            'username': 'reader', 'email': 'reader@example.com', 'bio': "О себе",
+        })
+        self.assertRedirects(response, reverse('profile_view', args=['reader']), fetch_redirect_response=False)
+
+    def test_shop_home(self):
+        self.assertEqual(self.request_within_budget('get', reverse('shop_home')).status_code, 200)
+        response = self.request_within_budget('get', reverse('shop_home'), {'sort': 'price', 'min_price': '100'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_shop_facets_are_cached(self):
+        url = reverse('shop_home')
+        self.client.get(url, {'min_price': '100'})
+        # Другая сортировка — те же счётчики: каталог целиком больше не пересчитывается
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'min_price': '100', 'sort': 'price'})
+        self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+        self.assertEqual(response.context['categories'][0].product_count, 9)
+
+        # Новый товар меняет версию магазина, а с ней и ключ счётчиков
+        Product.objects.create(name="Ещё", description="Описание", category=self.category, price=Decimal(500))
+        response = self.client.get(url, {'min_price': '100', 'sort': 'price'})
+        self.assertEqual(response.context['categories'][0].product_count, 10)
+        self.assertEqual([bucket['count'] for bucket in response.context['price_buckets']], [11, 0, 0, 0])
+
+    def test_shop_category(self):
+        url = reverse('shop_category', args=[self.category.id])
+        self.assertEqual(self.request_within_budget('get', url, {'q': 'товар'}).status_code, 200)
+
+    def test_shop_product_detail(self):
+        url = reverse('shop_product_detail', args=[self.products[0].id])
+        self.assertEqual(self.request_within_budget('get', url).status_code, 200)
+
+    def test_anonymous_shop(self):
+        self.client.logout()
+        self.assertEqual(self.request_within_budget('get', reverse('shop_home')).status_code, 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('shop_home')).status_code, 200)
+
+    def test_shop_etag_follows_changes(self):
+        self.client.logout()
+        url = reverse('shop_home')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Изменение в другом процессе: у него свой экземпляр кеша версий, локальный кеш здесь не сброшен
+        FileBasedCache(settings.CACHES['versions']['LOCATION'], {}).set(SHOP_VERSION_KEY, time.time_ns(), None)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.products[0].name = "Переименован"
+        self.products[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Переименован")
+
+    def test_register(self):
+        self.client.logout()
+        self.assertEqual(self.request_within_budget('get', reverse('register')).status_code, 200)
+        response = self.request_within_budget('post', reverse('register'), {
+            'username': 'newbie', 'email': 'newbie@example.com',
+            'password1': 'long-pass-12345', 'password2': 'long-pass-12345',
+        })
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    def test_login_logout(self):
+        self.client.logout()
+        self.assertEqual(self.request_within_budget('get', reverse('login')).status_code, 200)
+        response = self.request_within_budget('post', reverse('login'), {'username': 'reader', 'password': 'secret-pass-1'})
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        response = self.request_within_budget('get', reverse('logout'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+
+class PostCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        UserProfile.objects.create(user=cls.author)
+        cls.readers = [User.objects.create_user(f'reader{i}') for i in range(2)]
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.author)
+        Like.objects.create(user=cls.readers[0], post=cls.post)
+
+    def setUp(self):
+        cache.clear()
+
+    def home(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('home')).content.decode()
+
+    def test_viewers_share_card(self):
+        self.assertIn('❤️', self.home(self.readers[0]))
+        key = f'post_card:{self.post.pk}:{post_card_version(self.post)}'
+        html = cache.get(key)
+        # В кеше — метка вместо сердечка, ничего от конкретного пользователя
+        self.assertIn(POST_CARD_LIKE_MARKER, html)
+        self.assertNotIn('❤️', html)
+        self.assertNotIn('🤍', html)
+
+        # Второй пользователь получает ту же запись кеша со своим сердечком
+        cache.set(key, html.replace("Пост", "Из кеша"))
+        page = self.home(self.readers[1])
+        self.assertIn("Из кеша", page)
+        self.assertIn('🤍', page)
+        self.assertNotIn('❤️', page)
+
+    def test_changes_update_card(self):
+        page = self.home(self.readers[0])
+        self.assertIn('1 <!-- Хранимый счётчик -->', page)
+        self.assertIn('Аватар по умолчанию', page)
+
+        profile = self.author.profile
+        profile.avatar = 'avatars/author.jpg'
+        profile.save()
+        self.assertIn('src="/media/avatars/author.jpg"', self.home(self.readers[0]))
+
+        Like.objects.create(user=self.readers[1], post=self.post)
+        self.assertIn('2 <!-- Хранимый счётчик -->', self.home(self.readers[0]))
+
+        Comment.objects.create(post=self.post, author=self.readers[1], content="Комментарий")
+        self.assertIn('1 <!-- Количество комментариев -->', self.home(self.readers[0]))
+
+
+class PostCountersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.readers = [User.objects.create_user(f'reader{i}') for i in range(3)]
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.author)
+        cls.other_post = Post.objects.create(title="Другой", content="Текст", author=cls.readers[0])
+
+    def assert_counters(self, post, like_count, comment_count):
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual((post.like_count, post.comment_count), (like_count, comment_count))
+        # Совпадают с настоящим числом строк
+        self.assertEqual((post.likes.count(), post.comments.count()), (like_count, comment_count))
+
+    def test_create_and_delete(self):
+        likes = [Like.objects.create(user=reader, post=self.post) for reader in self.readers]
+        root = Comment.objects.create(post=self.post, author=self.readers[1], content="Корень")
+        reply = Comment.objects.create(post=self.post, author=self.author, content="Ответ", parent=root)
+        self.assert_counters(self.post, 3, 2)
+
+        likes[0].delete()
+        reply.delete()
+        self.assert_counters(self.post, 2, 1)
+        # Изменение комментария счётчик не трогает
+        root.content = "Исправлен"
+        root.save()
+        self.assert_counters(self.post, 2, 1)
+
+    def test_queryset_and_cascade_delete(self):
+        for reader in self.readers:
+            Like.objects.create(user=reader, post=self.post)
+        root = Comment.objects.create(post=self.post, author=self.author, content="Корень")
+        for reader in self.readers:
+            Comment.objects.create(post=self.post, author=reader, content="Ответ", parent=root)
+        self.assert_counters(self.post, 3, 4)
+
+        # Как действие "удалить выбранные" в админке
+        Like.objects.filter(user__in=self.readers[:2]).delete()
+        self.assert_counters(self.post, 1, 4)
+        # Удаление корня уносит ответы каскадом
+        root.delete()
+        self.assert_counters(self.post, 1, 0)
+
+    def test_deleting_user_cascades(self):
+        # reader0 лайкал и комментировал чужой пост, а на его собственный пост отвечали другие
+        Like.objects.create(user=self.readers[0], post=self.post)
+        Like.objects.create(user=self.readers[1], post=self.post)
+        root = Comment.objects.create(post=self.post, author=self.readers[0], content="Корень")
+        Comment.objects.create(post=self.post, author=self.readers[1], content="Ответ", parent=root)
+        Comment.objects.create(post=self.post, author=self.readers[1], content="Отдельно")
+        Like.objects.create(user=self.readers[1], post=self.other_post)
+        Comment.objects.create(post=self.other_post, author=self.readers[1], content="Комментарий")
+        self.assert_counters(self.post, 2, 3)
+
+        self.readers[0].delete()
+        self.assertFalse(Post.objects.filter(pk=self.other_post.pk).exists())
+        self.assert_counters(self.post, 1, 1)
+        User.objects.filter(pk=self.readers[1].pk).delete()
+        self.assert_counters(self.post, 0, 0)
+
+    def test_recount(self):
+        Like.objects.create(user=self.readers[0], post=self.post)
+        Comment.objects.create(post=self.post, author=self.readers[0], content="Комментарий")
+        Like.objects.create(user=self.readers[1], post=self.other_post)
+        # Счётчики разошлись с данными (update() и bulk-операции не шлют сигналов)
+        Post.objects.update(like_count=7, comment_count=5)
+        generation = versions.get(POST_CARDS_GENERATION_KEY)
+
+        call_command('recount_post_counters', stdout=StringIO())
+        self.assert_counters(self.post, 1, 1)
+        self.assert_counters(self.other_post, 1, 0)
+        self.assertNotEqual(versions.get(POST_CARDS_GENERATION_KEY), generation)
+
+
+@override_settings(COMMENT_THREADS_PAGE_SIZE=2, COMMENT_REPLIES_PER_THREAD=2)
+class CommentThreadsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('reader')
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.user)
+        # Корни созданы раньше ответов: порядок дерева — не порядок создания
+        cls.roots = [Comment.objects.create(post=cls.post, author=cls.user, content=f"Корень {i}") for i in range(3)]
+        first, second = cls.roots[:2]
+        reply = Comment.objects.create(post=cls.post, author=cls.user, content="Ответ 1", parent=first)
+        cls.nested = Comment.objects.create(post=cls.post, author=cls.user, content="Ответ на ответ", parent=reply)
+        cls.hidden = Comment.objects.create(post=cls.post, author=cls.user, content="Ответ 2", parent=first)
+        cls.replies = [reply, cls.nested, cls.hidden]
+        cls.second_reply = Comment.objects.create(post=cls.post, author=cls.user, content="Ответ", parent=second)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_tree_order_and_reply_cap(self):
+        response = self.client.get(reverse('post_detail', args=[self.post.id]))
+        threads = response.context['comment_threads']
+        first, second = self.roots[:2]
+        self.assertEqual([[comment.pk for comment in thread['comments']] for thread in threads], [
+            [first.pk, self.replies[0].pk, self.nested.pk],
+            [second.pk, self.second_reply.pk],
+        ])
+        self.assertEqual([comment.depth for comment in threads[0]['comments']], [0, 1, 2])
+        self.assertEqual(threads[0]['more_replies_after'], self.nested.path)
+        self.assertIsNone(threads[1]['more_replies_after'])
+        self.assertEqual(response.context['more_threads_after'], second.path)
+
+        # Продолжение ветки начинается с первого скрытого ответа
+        response = self.client.get(reverse('comment_replies', args=[self.post.id, first.id]),
+                                   {'after': threads[0]['more_replies_after']})
+        self.assertEqual([reply.pk for reply in response.context['replies']], [self.hidden.pk])
+
+    def test_next_threads(self):
+        response = self.client.get(reverse('comment_threads', args=[self.post.id]), {'after': self.roots[1].path})
+        threads = response.context['comment_threads']
+        self.assertEqual([thread['root'].pk for thread in threads], [self.roots[2].pk])
+        self.assertEqual(threads[0]['comments'], [threads[0]['root']])
+        self.assertIsNone(response.context['more_threads_after'])
+
+    def test_reads_bounded_by_page(self):
+        # Под первым корнем много ответов: запрос веток берёт не больше N+2 комментария на ветку
+        for _ in range(20):
+            Comment.objects.create(post=self.post, author=self.user, content="Ещё", parent=self.roots[0])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('comment_threads', args=[self.post.id]))
+        self.assertEqual(len(response.context['comment_threads'][0]['comments']), 3)
+        sql = next(query['sql'] for query in queries.captured_queries if 'UNION ALL' in query['sql'])
+        self.assertEqual(sql.count('LIMIT 4'), 2)
+
+
+class LikeBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.readers = [User.objects.create_user(f'reader{i}') for i in range(3)]
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.author)
+        Like.objects.create(user=cls.readers[0], post=cls.post)
+
+    def setUp(self):
+        cache.clear()
+
+    def toggle(self, user, **data):
+        # Свой клиент на каждый запрос — как разные процессы: общего у них только БД
+        client = Client()
+        client.force_login(user)
+        response = client.post(reverse('toggle_like', args=[self.post.id]), data, HTTP_ACCEPT='application/json')
+        return response.json()
+
+    def test_toggles_are_buffered_and_collapsed(self):
+        self.assertEqual(self.toggle(self.readers[1]), {'liked': True, 'like_count': 2})
+        self.assertEqual(self.toggle(self.readers[1]), {'liked': False, 'like_count': 1})
+        self.assertEqual(self.toggle(self.readers[1]), {'liked': True, 'like_count': 2})
+        self.assertEqual(self.toggle(self.readers[2], state='1'), {'liked': True, 'like_count': 3})
+        self.assertEqual(self.toggle(self.readers[2], state='1'), {'liked': True, 'like_count': 3})
+        self.assertEqual(self.toggle(self.readers[0], state='0'), {'liked': False, 'like_count': 2})
+        # До записи в БД менялись только события; повтор state=1 события не добавил
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+        self.assertEqual(LikeEvent.objects.count(), 5)
+
+        # Одна транзакция на пачку: события, лайки и счётчики всех постов; вторая пачка пуста
+        with self.assertNumQueries(11):
+            self.assertEqual(like_buffer.flush(), (2, 1))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 2)
+        self.assertEqual(set(self.post.likes.values_list('user_id', flat=True)),
+                         {self.readers[1].pk, self.readers[2].pk})
+        self.assertFalse(LikeEvent.objects.exists())
+        self.assertEqual(like_buffer.flush(), (0, 0))
+
+    def test_last_action_wins(self):
+        # Лайк и отмена — через разные "процессы": отмена видит незаписанный лайк
+        self.assertEqual(self.toggle(self.readers[1], state='1'), {'liked': True, 'like_count': 2})
+        self.assertEqual(self.toggle(self.readers[1], state='0'), {'liked': False, 'like_count': 1})
+        self.assertEqual(like_buffer.flush(), (0, 0))
+        self.assertFalse(self.post.likes.filter(user=self.readers[1]).exists())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+    def test_stale_reads_record_one_event(self):
+        # Двойной клик: оба запроса прочитали состояние до того, как другой записал событие
+        def stale_posts():
+            queryset = like_buffer.with_like_state(Post.objects.all(), self.readers[1].pk)
+            return queryset.get(pk=self.post.pk), queryset.get(pk=self.post.pk)
+
+        for state, like_count in ((True, 2), (False, 1)):
+            first, second = stale_posts()
+            self.assertEqual(toggles.toggle_like(self.readers[1].pk, first, state), (state, like_count))
+            self.assertEqual(toggles.toggle_like(self.readers[1].pk, second, state), (state, like_count))
+            self.assertEqual(self.client.get(reverse('home')).context['posts'][0].like_count, like_count)
+        self.assertEqual(LikeEvent.objects.count(), 2)
+        self.assertEqual(like_buffer.flush(), (0, 0))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+    def test_pending_like_is_visible_to_viewer(self):
+        self.client.force_login(self.readers[1])
+        url = reverse('post_detail', args=[self.post.id])
+        etag = self.client.get(url)['ETag']
+        self.toggle(self.readers[1])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['post'].is_liked)
+        self.assertEqual(response.context['post'].like_count, 2)
+        response = self.client.get(reverse('home'))
+        self.assertTrue(response.context['posts'][0].is_liked)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('home')).context['posts'][0].like_count, 2)
+
+    def test_claimed_events_are_not_applied_twice(self):
+        self.toggle(self.readers[1])
+        events = list(LikeEvent.objects.values_list('id', 'user_id', 'post_id', 'liked'))
+        # Другой обработчик успел забрать события
+        LikeEvent.objects.all().delete()
+        with self.assertRaises(like_buffer.Conflict):
+            like_buffer.write(events)
+        self.assertFalse(self.post.likes.filter(user=self.readers[1]).exists())
+
+    def test_deleted_post_drops_events(self):
+        self.toggle(self.readers[1])
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertFalse(LikeEvent.objects.exists())
+        self.assertEqual(like_buffer.flush(), (0, 0))
+
+
+class PostDetailETagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.reader = User.objects.create_user('reader')
+        cls.commenter = User.objects.create_user('commenter')
+        UserProfile.objects.create(user=cls.commenter)
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.author)
+        Comment.objects.create(post=cls.post, author=cls.commenter, content="Комментарий")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+        self.url = reverse('post_detail', args=[self.post.id])
+
+    def reload(self, etag):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def assert_not_modified(self, etag):
+        response, statements = self.reload(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([sql for sql in statements if 'app_comment' in sql])
+
+    def assert_changed(self, etag):
+        response, statements = self.reload(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_unchanged_reload(self):
+        # Первая перезагрузка — уже с cookie CSRF из первого ответа
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assert_not_modified(response['ETag'])
+        self.assert_not_modified(response['ETag'])
+
+    def test_changes_invalidate(self):
+        etag = self.client.get(self.url)['ETag']
+        Comment.objects.create(post=self.post, author=self.author, content="Ещё")
+        etag = self.assert_changed(etag)
+
+        self.client.post(reverse('toggle_like', args=[self.post.id]), HTTP_ACCEPT='application/json')
+        etag = self.assert_changed(etag)
+
+        # Аватар и имя комментатора видны в ветке комментариев
+        self.commenter.profile.bio = "Новое"
+        self.commenter.profile.save()
+        etag = self.assert_changed(etag)
+        self.commenter.username = 'renamed'
+        self.commenter.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'renamed')
+        self.assert_not_modified(response['ETag'])
+
+
+class PostSaveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.post = Post.objects.create(title="Пост", content="Текст", author=cls.author, image='post_images/a.jpg')
+
+    def test_edit_is_one_update(self):
+        post = Post.objects.get(pk=self.post.pk)
+        post.title = "Изменён"
+        with self.assertNumQueries(1):
+            post.save()
+        self.assertEqual(ImageJob.objects.filter(object_id=post.pk).count(), 1)
+
+        post.image = 'post_images/b.jpg'
+        post.save()
+        self.assertEqual(set(ImageJob.objects.filter(object_id=post.pk).values_list('source', flat=True)),
+                         {'post_images/a.jpg', 'post_images/b.jpg'})
+
+    def test_stale_instance_keeps_variants(self):
+        stale = Post.objects.get(pk=self.post.pk)
+        manifest = {'source': 'post_images/a.jpg', 'variants': [{'name': 'post_images/a-400.webp', 'width': 400}]}
+        Post.objects.filter(pk=self.post.pk).update(image_variants=manifest, like_count=3)
+        stale.title = "Изменён"
+        stale.save()
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual((post.title, post.image_variants, post.like_count), ("Изменён", manifest, 3))
+
+
+class TemporaryMediaMixin:
+    # MEDIA_ROOT во временном каталоге, удаляется после теста
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        settings_override = override_settings(MEDIA_ROOT=self.media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def write_image(self, name, size=(200, 100), mode='RGB', data=None):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if data is not None:
+            with open(path, 'wb') as file:
+                file.write(data)
+        else:
+            Image.new(mode, size).save(path, format='PNG' if name.endswith('.png') else 'JPEG')
+        return name
+
+
+class ImageJobTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('author')
+        self.post = Post.objects.create(title="Пост", content="Текст", author=self.author,
+                                        image=self.write_image('post_images/photo.jpg'))
+        self.job = ImageJob.objects.get()
+
+    def test_enqueue_is_idempotent(self):
+        ImageJob.enqueue(self.post, 'image')
+        ImageJob.enqueue(Post.objects.get(pk=self.post.pk), 'image')
+        self.post.title = "Изменён"
+        self.post.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+    def test_done(self):
+        job = claim_job()
+        self.assertEqual((job.pk, job.status, job.attempts), (self.job.pk, 'running', 1))
+        self.assertEqual(process_job(job), 'done')
+        self.assertIsNone(claim_job())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.image_variants['source'], 'post_images/photo.jpg')
+        self.assertTrue(self.post.image_variants['variants'])
+
+    def test_retry_with_backoff_then_failed(self):
+        self.write_image('post_images/photo.jpg', data=b'not an image')
+        ImageJob.objects.filter(pk=self.job.pk).update(max_attempts=2)
+
+        started = timezone.now()
+        self.assertEqual(process_job(claim_job()), 'pending')
+        job = ImageJob.objects.get(pk=self.job.pk)
+        self.assertIn('UnidentifiedImageError', job.last_error)
+        self.assertIsNone(job.locked_at)
+        # Первый повтор — через 2 ** 1 * 10 секунд, раньше задачу не взять
+        self.assertGreaterEqual(job.run_after, started + timedelta(seconds=20))
+        self.assertIsNone(claim_job())
+
+        ImageJob.objects.filter(pk=self.job.pk).update(run_after=timezone.now())
+        job = claim_job()
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(process_job(job), 'failed')
+        self.assertIsNone(claim_job())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image_variants, {})
+
+    def test_stale_running_job_is_reclaimed(self):
+        claim_job()
+        # Обработчик упал, не закончив задачу: пока блокировка свежая, задачу никто не берёт
+        self.assertIsNone(claim_job(stale_after=600))
+        ImageJob.objects.filter(pk=self.job.pk).update(locked_at=timezone.now() - timedelta(seconds=601))
+        job = claim_job(stale_after=600)
+        self.assertEqual((job.pk, job.status, job.attempts), (self.job.pk, 'running', 2))
+        self.assertEqual(process_job(job), 'done')
+
+    def test_replaced_source_is_noop(self):
+        Post.objects.filter(pk=self.post.pk).update(image=self.write_image('post_images/other.jpg'))
+        self.assertEqual(process_job(claim_job()), 'done')
+        self.assertEqual(Post.objects.get(pk=self.post.pk).image_variants, {})
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'derived')))
+
+    def test_deleted_object_is_noop(self):
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(process_job(claim_job()), 'done')
+        self.assertFalse(os.path.exists(os.path.join(self.media, 'derived')))
+
+
+class ImageVariantsTests(TemporaryMediaMixin, TestCase):
+    def build(self, name, **kwargs):
+        self.write_image(name, **kwargs)
+        return build_variants(Post(image=name).image)
+
+    def test_variants(self):
+        manifest = self.build('post_images/photo.jpg', size=(200, 100))
+        with open(os.path.join(self.media, 'post_images/photo.jpg'), 'rb') as file:
+            digest = hashlib.sha256(file.read()).hexdigest()[:20]
+        self.assertEqual(manifest['source'], 'post_images/photo.jpg')
+        # Копии не шире оригинала: 320 и больше заменяет сам размер оригинала
+        self.assertEqual(sorted((variant['width'], variant['format']) for variant in manifest['variants']), [
+            (64, 'jpeg'), (64, 'webp'), (160, 'jpeg'), (160, 'webp'), (200, 'jpeg'), (200, 'webp'),
+        ])
+        for variant in manifest['variants']:
+            self.assertEqual(variant['name'], f"derived/{digest[:2]}/{digest}-{variant['width']}.{variant['format']}")
+            with Image.open(default_storage.path(variant['name'])) as img:
+                self.assertEqual((img.format.lower(), img.width), (variant['format'], variant['width']))
+        # Повторная обработка того же файла даёт те же имена и ничего не пересоздаёт
+        paths = [default_storage.path(variant['name']) for variant in manifest['variants']]
+        for path in paths:
+            os.utime(path, (0, 0))
+        self.assertEqual(build_variants(Post(image='post_images/photo.jpg').image), manifest)
+        self.assertEqual({os.path.getmtime(path) for path in paths}, {0})
+
+    def test_transparent_image_falls_back_to_png(self):
+        manifest = self.build('post_images/logo.png', size=(100, 100), mode='RGBA')
+        self.assertEqual({variant['format'] for variant in manifest['variants']}, {'webp', 'png'})
+
+    def render(self, post):
+        return Template('{% load custom_filters %}{% responsive_image post.image post.image_variants alt="Фото" %}') \
+            .render(Context({'post': post}))
+
+    def test_responsive_image_tag(self):
+        post = Post(image='post_images/photo.jpg')
+        post.image_variants = self.build('post_images/photo.jpg')
+        html = self.render(post)
+        self.assertIn('<picture><source type="image/webp" srcset="', html)
+        self.assertIn('-200.webp 200w', html)
+        self.assertIn('<img src="/media/derived/', html)
+        self.assertIn('-200.jpeg 200w" sizes="100vw" alt="Фото"></picture>', html)
+
+        # Список копий от прежнего файла — обычный <img> с оригиналом
+        post.image = 'post_images/new.jpg'
+        self.assertEqual(self.render(post), '<img src="/media/post_images/new.jpg" alt="Фото">')
+        post.image_variants = {}
+        self.assertEqual(self.render(post), '<img src="/media/post_images/new.jpg" alt="Фото">')
+
+
+class GcMediaTests(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create_user('author')
+        post = Post.objects.create(title="Пост", content="Текст", author=author)
+        # update() — без сигналов и постановки в очередь обработки изображений
+        Post.objects.filter(pk=post.pk).update(
+            image='post_images/photo.jpg',
+            image_variants={'variants': [{'name': 'post_images/photo-400.webp', 'width': 400}]},
+        )
+        old = time.time() - 2 * 3600
+        self.files = {
+            'post_images/photo.jpg': old,
+            'post_images/photo-400.webp': old,
+            'post_images/orphan.jpg': old,
+            # Только что загружен, запись в БД ещё не сохранена
+            'post_images/uploading.jpg': time.time(),
+        }
+        for name, mtime in self.files.items():
+            path = os.path.join(self.media, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'x' * 10)
+            os.utime(path, (mtime, mtime))
+
+    def gc(self, *args):
+        out = StringIO()
+        call_command('gc_media', *args, stdout=out)
+        return out.getvalue()
+
+    def remaining(self):
+        return {name for name in self.files if os.path.exists(os.path.join(self.media, name))}
+
+    def test_dry_run_removes_nothing(self):
+        output = self.gc('--dry-run')
+        self.assertIn('post_images/orphan.jpg', output)
+        self.assertNotIn('post_images/photo', output)
+        self.assertEqual(self.remaining(), set(self.files))
+
+    def test_removes_only_old_unreferenced_files(self):
+        self.gc()
+        self.assertEqual(self.remaining(), {'post_images/photo.jpg', 'post_images/photo-400.webp',
+                                            'post_images/uploading.jpg'})
+        # --min-age 0 — свежие файлы тоже, файлы из FileField и манифеста копий остаются
+        self.gc('--min-age', '0')
+        self.assertEqual(self.remaining(), {'post_images/photo.jpg', 'post_images/photo-400.webp'})
+
+
+# Транзакции настоящие: события уходят клиентам только после коммита
+class MessagesSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader')
+        self.author = User.objects.create_user('author')
+
+    def socket(self, user=None, origin=None):
+        headers = []
+        if user is not None:
+            client = Client()
+            client.force_login(user)
+            headers.append(('cookie', f"sessionid={client.cookies['sessionid'].value}"))
+        if origin is not None:
+            headers.append(('origin', origin))
+        return InProcessClient(headers=headers)
+
+    async def test_rejects_anonymous_and_foreign_origin(self):
+        self.assertEqual((await self.socket().connect())['code'], CLOSE_UNAUTHORIZED)
+        socket = await sync_to_async(self.socket)(self.reader, origin='https://evil.example')
+        self.assertEqual((await socket.connect())['code'], CLOSE_FORBIDDEN)
+
+    async def test_pushes_messages_and_read_receipts(self):
+        reader = await sync_to_async(self.socket)(self.reader, origin='http://testserver')
+        author = await sync_to_async(self.socket)(self.author)
+        self.assertEqual((await reader.connect())['type'], 'websocket.accept')
+        self.assertEqual((await author.connect())['type'], 'websocket.accept')
+        self.assertEqual(broker.connections(), 2)
+
+        message = await Message.objects.acreate(sender=self.author, recipient=self.reader, content="Привет")
+        for socket in (reader, author):
+            event = await socket.receive_json()
+            self.assertEqual((event['type'], event['id'], event['content']), ('message', message.pk, "Привет"))
+
+        await reader.send_json({'type': 'read', 'contact': self.author.pk, 'message': message.pk})
+        self.assertEqual(await author.receive_json(), {'type': 'read', 'reader': self.reader.pk})
+        conversation = await Conversation.objects.aget(user=self.reader, contact=self.author)
+        self.assertEqual(conversation.last_read_id, message.pk)
+
+        await reader.disconnect()
+        await author.disconnect()
+        self.assertEqual(broker.connections(), 0)
+
+    async def test_slow_client_gets_resync(self):
+        subscription = Subscription(self.reader.pk, asyncio.get_running_loop(), maxsize=2)
+        for i in range(3):
+            subscription.put({'type': 'message', 'id': i})
+        self.assertEqual(await subscription.get(), {'type': 'resync'})
+        self.assertTrue(subscription.queue.empty())
+
+
+@override_settings(NOTIFICATIONS_MIN_INTERVAL=0.2, NOTIFICATIONS_KEEPALIVE=0.5)
+class NotificationStreamTests(TransactionTestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user('reader')
+        self.author = User.objects.create_user('author')
+        self.post = Post.objects.create(title="Пост", content="Текст", author=self.reader)
+
+    async def next_chunk(self, stream):
+        return await asyncio.wait_for(anext(stream), 2)
+
+    async def test_stream(self):
+        await self.async_client.aforce_login(self.reader)
+        response = await self.async_client.get(reverse('notifications_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await self.next_chunk(stream), b'retry: 5000\n\n')
+        self.assertEqual(await self.next_chunk(stream), b'event: unread\ndata: {"count": 0}\n\n')
+
+        await Message.objects.acreate(sender=self.author, recipient=self.reader, content="Привет")
+        self.assertEqual(await self.next_chunk(stream), b'event: unread\ndata: {"count": 1}\n\n')
+
+        # Лайки и комментарии, пришедшие быстрее, чем клиент получает пачки, склеиваются
+        for i in range(5):
+            await sync_to_async(Comment.objects.create)(post=self.post, author=self.author, content=f"{i}")
+        chunk = await self.next_chunk(stream)
+        self.assertEqual(chunk.decode(), 'event: comment\ndata: {"count": 5, "post_id": %d, "title": "Пост"}\n\n'
+                         % self.post.pk)
+        self.assertEqual(await self.next_chunk(stream), b': keepalive\n\n')
+        await stream.aclose()
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+    @override_settings(QUERY_BUDGET_HEADERS=True)
+    def test_headers(self):
+        user = User.objects.create_user('reader')
+        for i in range(3):
+            Post.objects.create(title=f"Пост {i}", content="Текст", author=user)
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response['X-DB-Query-Budget'], str(resolve(reverse('home')).func.query_budget))
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+        self.assertTrue(response['X-DB-Time'].endswith('ms'))
+        self.assertEqual(response['X-DB-Duplicate-Queries'], '0')
+
+    @override_settings(QUERY_BUDGET_HEADERS=True)
+    async def test_async_requests(self):
+        # Под ASGI middleware работает в цикле событий, запросы синхронного представления
+        # в потоке sync_to_async всё равно учитываются
+        async def get_response(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(QueryBudgetMiddleware(get_response)))
+
+        user = await User.objects.acreate(username='reader')
+        await Post.objects.acreate(title="Пост", content="Текст", author=user)
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response['X-DB-Query-Budget'], str(resolve(reverse('home')).func.query_budget))
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+    def test_duplicate_fingerprints(self):
+        statements = [
+            'SELECT * FROM "app_like" WHERE "post_id" = %s',
+            'SELECT * FROM "app_like" WHERE "post_id" = %s',
+            'SELECT * FROM "app_post" WHERE "id" IN (%s, %s)',
+            'SELECT * FROM "app_post" WHERE "id" IN (%s, %s, %s)',
+            'SELECT * FROM "app_comment" WHERE "id" = 1',
+        ]
+        self.assertEqual(duplicate_queries(statements), {
+            'SELECT * FROM "app_like" WHERE "post_id" = %s': 2,
+            'SELECT * FROM "app_post" WHERE "id" IN (%s...)': 2,
+        })
@@ -0,0 +1,73 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .caching import bump_post_version
+from . import like_buffer
+from .models import Post, Like, Favorite
+from .realtime import notify_on_commit
+
+
+# Лайк и избранное переключаются одним SQL-запросом, без чтения перед записью:
+# INSERT ... ON CONFLICT DO NOTHING и DELETE по уникальной паре (user, post).
+# Двойной клик не упирается в unique_together — второй запрос просто ничего не меняет.
+# Сигналы Like при этом не срабатывают, поэтому счётчик и версию карточки обновляем здесь.
+def set_pair(model, user_id, post_id, state=None):
+    # state=True/False — нужное состояние (ровно один запрос), None — переключить.
+    # Возвращает (новое состояние, изменилась ли строка)
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if state is not True:
+            cursor.execute(f'DELETE FROM {table} WHERE user_id = %s AND post_id = %s', [user_id, post_id])
+            if cursor.rowcount or state is False:
+                return False, cursor.rowcount > 0
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, post_id, created_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT (user_id, post_id) DO NOTHING',
+            # Дата — в том же виде, в каком её пишет ORM, иначе не сработают сравнения по created_at
+            [user_id, post_id, connection.ops.adapt_datetimefield_value(timezone.now())],
+        )
+        return True, cursor.rowcount > 0
+
+
+def add_like_delta(post_id, delta):
+    # Новое значение счётчика возвращает тот же UPDATE
+    table = connection.ops.quote_name(Post._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET like_count = like_count + %s WHERE id = %s AND like_count + %s >= 0 '
+            f'RETURNING like_count',
+            [delta, post_id, delta],
+        )
+        row = cursor.fetchone()
+    bump_post_version(post_id)
+    return row[0] if row else 0
+
+
+def toggle_like(user_id, post, state=None):
+    # Возвращает (лайкнут ли пост, like_count).
+    # post — с аннотациями like_buffer.with_like_state для этого пользователя
+    if settings.LIKE_BUFFER:
+        liked = not post.is_liked if state is None else state
+        if liked == post.is_liked:
+            return liked, post.like_count + post.pending_likes
+        # post прочитан до вставки: параллельный запрос мог уже записать то же событие,
+        # поэтому record сверяет состояние сам, а счётчик перечитывается после
+        if like_buffer.record(user_id, post.pk, liked) and liked:
+            notify_liked(user_id, post)
+        return liked, like_buffer.like_count(post.pk)
+    with transaction.atomic():
+        liked, changed = set_pair(Like, user_id, post.pk, state)
+        if not changed:
+            return liked, post.like_count
+        if liked:
+            notify_liked(user_id, post)
+        return liked, add_like_delta(post.pk, 1 if liked else -1)
+
+
+def notify_liked(user_id, post):
+    if post.author_id != user_id:
+        notify_on_commit(post.author_id, {'type': 'like', 'post_id': post.pk, 'title': post.title})
+
+
+def toggle_favorite(user_id, post, state=None):
+    return set_pair(Favorite, user_id, post.pk, state)[0]
@@ -13,12 +13,17 @@ urlpatterns = [
     path('post/<int:post_id>/delete', views.post_delete, name='post_delete'),
     path('post/<int:post_id>/like', views.toggle_like, name='toggle_like'),
     path('post/<int:post_id>/comment', views.add_comment, name='add_comment'),
+    path('post/<int:post_id>/comments/', views.comment_threads, name='comment_threads'),
+    path('post/<int:post_id>/comments/<int:comment_id>/replies/', views.comment_replies, name='comment_replies'),
+    path('search/', views.search, name='search'),
     path('favorites/', views.favorites, name='favorites'),
     path('post/<int:post_id>/toggle_favorite/', views.toggle_favorite, name='toggle_favorite'),
 
     path('messages/', views.messages_list, name='messages_list'),
     path('messages/<int:recipient_id>/', views.messages_list, name='messages_list'),
+    path('messages/<int:recipient_id>/older/', views.messages_older, name='messages_older'),
     path('messages/send/<int:recipient_id>', views.send_message, name='send_message'),
+    path('notifications/stream/', views.notifications_stream, name='notifications_stream'),
 
     path('profile', views.profile_edit, name='profile_edit'),
     path('profile/<str:username>/', views.profile_view, name='profile_view'),
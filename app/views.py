@@ -1,16 +1,35 @@
+import hashlib
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponseRedirect, request
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse, request
+from django.core.handlers.asgi import ASGIRequest
+from django.middleware.csrf import get_token
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.urls import reverse
 from django.contrib.auth.models import User
-from django.db.models import Q
-from .forms import UserRegisterForm, UserLoginForm, PostForm, CommentForm, UserProfileForm, MessageForm
-from .models import UserProfile, Post, Like, Comment, Favorite, Message, Product, Category
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q, Count, Exists, OuterRef
+from django.db.models.expressions import RawSQL
+from .forms import UserRegisterForm, UserLoginForm, PostForm, CommentForm, UserProfileForm, MessageForm, ProductFilterForm
+from .models import UserProfile, Post, Comment, Favorite, Message, Conversation, Product, Category
+from .middleware import query_budget
+from .pagination import CursorPage, NEXT, decode_cursor, encode_cursor, paginate_by_cursor
+from .caching import (get_unread_count, comments_version, profile_version,
+                      cache_anonymous_shop_page, cached_shop_facets, shop_version, shop_last_modified)
+from .search import search as search_index, product_ids_sql
+from .like_buffer import with_like_state
+from .realtime import mark_conversation_read, message_event
+from .notifications import notification_stream
+from . import toggles
 
 
 # Create your views here.
+@query_budget(3)
 def register(request):
     if request.method == 'POST':
         form = UserRegisterForm(request.POST)
@@ -24,6 +43,7 @@ def register(request):
     return render(request, "app/register.html", {'form': form})
 
 
+@query_budget(9)
 def user_login(request):
     if request.method == 'POST':
         form = UserLoginForm(request.POST)
@@ -42,47 +62,147 @@ def user_login(request):
     return render(request, 'app/login.html', {'form': form})
 
 
+@query_budget(4)
 def user_logout(request):
     logout(request)
     return redirect('login')
 
 
+@query_budget(7)
 def home(request):
-    # Получаем все объекты Post из базы данных
-    posts = Post.objects.all()
+    # Получаем одну страницу постов (keyset-пагинация по created_at, id)
+    page = paginate_by_cursor(
+        Post.objects.select_related('author__profile').defer('content'),
+        cursor=request.GET.get('cursor'),
+    )
 
     # Передаем список posts в шаблон home.html через контекст
     context = {
-        'posts': posts,  # 'posts' - это имя переменной, которое будет доступно в шаблоне
+        'posts': attach_viewer_state(page.items, request.user),  # 'posts' - это имя переменной, которое будет доступно в шаблоне
+        'page': page,
     }
     return render(request, 'app/home.html', context)
 
 
+@query_budget(6)
+def search(request):
+    # Полнотекстовый поиск по постам и комментариям: результаты по релевантности
+    query = request.GET.get('q', '').strip()
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+    page_size = settings.SEARCH_PAGE_SIZE
+
+    results = []
+    has_next = False
+    if query:
+        # Берём на одну запись больше, чтобы знать, есть ли следующая страница
+        results = search_index(query, limit=page_size + 1, offset=(page_number - 1) * page_size)
+        has_next = len(results) > page_size
+        results = results[:page_size]
+        posts = Post.objects.select_related('author').defer('content').in_bulk({r['post_id'] for r in results})
+        for result in results:
+            result['post'] = posts.get(result['post_id'])
+
+    context = {
+        'query': query,
+        'results': results,
+        'page_number': page_number,
+        'has_next': has_next,
+        'has_previous': page_number > 1,
+    }
+    return render(request, 'app/search.html', context)
+
+
+def post_detail_etag(request, post_id):
+    # Дешёвый валидатор страницы поста: одна строка поста с отметками текущего
+    # пользователя плюс версии из кеша. Всё, что видно на странице, должно в него входить.
+    if not request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+    # Лайки, ещё не записанные из буфера, тоже видны на странице
+    row = with_like_state(Post.objects.filter(pk=post_id), request.user.pk).annotate(
+        is_favorite=Exists(Favorite.objects.filter(post=OuterRef('pk'), user=request.user)),
+    ).values_list('updated_at', 'like_count', 'pending_likes', 'comment_count', 'author_id', 'is_liked',
+                  'is_favorite').first()
+    if row is None:
+        return None
+    updated_at, like_count, pending_likes, comment_count, author_id, is_liked, is_favorite = row
+    like_count += pending_likes
+    # Токен создаётся здесь, а не при отрисовке шаблона: тогда cookie, выданная с первым
+    # ответом, даёт тот же ETag, и 304 приходит уже на первой перезагрузке
+    get_token(request)
+    parts = [
+        updated_at.isoformat(), like_count, comment_count, comments_version(post_id), profile_version(author_id),
+        is_liked, is_favorite,
+        # Шапка страницы: пользователь, непрочитанные и CSRF-токен формы комментария
+        request.user.pk, get_unread_count(request.user.pk), request.META.get('CSRF_COOKIE', ''),
+    ]
+    return hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+
+
+@query_budget(10)
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=post_detail_etag)
 def post_detail(request, post_id):
     # Получаем конкретный пост по ID или возвращаем 404, если не найден
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.select_related('author__profile'), id=post_id)
 
-    user_liked = False
-    if request.user.is_authenticated:
-        post.user_liked = post.likes.filter(user=request.user).exists()
-    user_favorite = post.favorite_by.filter(user=request.user).exists()
-    all_comments = Comment.objects.filter(post=post).select_related("author").prefetch_related(
-        "comment_likes").order_by("create_at")
-    comment_tree = build_comment_tree(all_comments)
+    attach_viewer_state([post], request.user)
+    # Первые ветки комментариев с ограниченным числом ответов, а не все комментарии поста
+    threads, has_more_threads = load_comment_threads(post)
 
     comment_form = CommentForm(post_id=post_id)
 
     # Можно передать дополнительные данные, например, комментарии
     return render(request, 'app/post_detail.html', {
         'post': post,
-        'user_liked': user_liked,
+        'user_liked': post.is_liked,
         'comment_form': comment_form,
-        "comment_tree": comment_tree,
-        'user_favorite ': user_favorite,
+        "comment_threads": threads,
+        'user_favorite': post.is_favorite,
+        'more_threads_after': threads[-1]['root'].path if has_more_threads else None,
+    })
+
+
+@query_budget(5)
+@login_required
+def comment_threads(request, post_id):
+    # Догрузка следующих корневых веток (HTML-фрагмент)
+    post = get_object_or_404(Post, id=post_id)
+    threads, has_more_threads = load_comment_threads(post, after=request.GET.get('after'))
+    return render(request, 'app/comment_fragment.html', {
+        'post': post,
+        'comment_threads': threads,
+        'more_threads_after': threads[-1]['root'].path if has_more_threads else None,
     })
 
 
+@query_budget(4)
+@login_required
+def comment_replies(request, post_id, comment_id):
+    # Догрузка следующих ответов внутри ветки comment_id (HTML-фрагмент)
+    comment = get_object_or_404(Comment, id=comment_id, post_id=post_id)
+    after = request.GET.get('after', '')
+    if not comment.path <= after < comment.subtree_upper_bound():
+        after = comment.path
+
+    page_size = settings.COMMENT_REPLIES_PAGE_SIZE
+    replies = list(Comment.objects.filter(
+        post_id=post_id, path__gt=after, path__lt=comment.subtree_upper_bound()
+    ).select_related('author__profile').order_by('path')[:page_size + 1])
+    has_more = len(replies) > page_size
+    replies = replies[:page_size]
+    return render(request, 'app/comment_fragment.html', {
+        'post_id': post_id,
+        'replies': replies,
+        'thread': comment,
+        'more_replies_after': replies[-1].path if has_more else None,
+    })
+
+
+@query_budget(4)
 @login_required
 def post_create(request):
     if request.method == "POST":
@@ -98,10 +218,11 @@ def post_create(request):
     return render(request, 'app/post_create.html', {'form': form})
 
 
+@query_budget(10)
 @login_required
 def post_delete(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    if post.author != request.user:
+    if post.author_id != request.user.id:
         messages.error(request, "У вас нет прав для удаления этого поста")
         return redirect('home')
 
@@ -115,22 +236,24 @@ def post_delete(request, post_id):
     return redirect('post_detail', post_id=post.id)
 
 
+@query_budget(8)
 @login_required
+@require_POST
 def toggle_like(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    like_obj, created = Like.objects.get_or_create(user=request.user, post=post)
-
-    if created:
-        action = 'Liked'
-    else:
-        like_obj.delete()
-        action = 'unliked'
+    post = get_object_or_404(
+        with_like_state(Post.objects.only('id', 'title', 'author_id', 'like_count'), request.user.pk), id=post_id,
+    )
+    liked, like_count = toggles.toggle_like(request.user.id, post, requested_state(request))
+    if wants_json(request):
+        return JsonResponse({'liked': liked, 'like_count': like_count})
+
+    action = 'Liked' if liked else 'unliked'
     messages.info(request, f"Вы {action} пост {post.title}.")
-
     next_url = request.META.get('HTTP_REFERER', reverse('home'))
     return HttpResponseRedirect(next_url)
 
 
+@query_budget(6)
 @login_required
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
@@ -151,6 +274,7 @@ def post_edit(request, post_id):
     return render(request, 'app/post_edit.html', {'form': form, 'post': post})
 
 
+@query_budget(6)
 @login_required
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
@@ -167,25 +291,76 @@ def add_comment(request, post_id):
     return redirect('post_detail', post_id=post.id)  # Исправлено: post_id вместо post_id.id
 
 
-# Построение дерева коментариев
-def build_comment_tree(comments):
-    comment_dict = {}
-    root_comments = []
-
-    for comment in comments:
-        comment_dict[comment.id] = {'comment': comment, 'replies': []}
-
-    for item in comment_dict.values():
-        comment_obj = item['comment']
-        if comment_obj.parent_id:
-            parent_item = comment_dict.get(comment_obj.parent_id)
-            if parent_item:
-                parent_item['replies'].append(item)
-        else:
-            root_comments.append(item)
-    return root_comments
-
-
+def wants_json(request):
+    # fetch-клиенты просят JSON явно; обычная отправка формы принимает text/html и получает редирект
+    return request.accepts('application/json') and not request.accepts('text/html')
+
+
+def requested_state(request):
+    # Клиент может передать нужное состояние (state=1/0) — тогда повтор запроса ничего не меняет
+    return {'1': True, '0': False}.get(request.POST.get('state'))
+
+
+# Отметки "лайкнул" и "в избранном" для всей страницы постов: два запроса вместо двух на каждый пост.
+# Лайки — с учётом буфера (like_buffer.with_like_state), счётчик тоже
+def attach_viewer_state(posts, user):
+    posts = list(posts)
+    likes, favorite_ids = {}, set()
+    if posts:
+        post_ids = [post.id for post in posts]
+        fields = ['pk', 'pending_likes'] + (['is_liked'] if user.is_authenticated else [])
+        likes = {row['pk']: row for row in with_like_state(Post.objects.filter(pk__in=post_ids), user.pk).values(*fields)}
+        if user.is_authenticated:
+            favorite_ids = set(Favorite.objects.filter(user=user, post_id__in=post_ids).values_list('post_id', flat=True))
+    for post in posts:
+        row = likes.get(post.id, {})
+        post.like_count += row.get('pending_likes', 0)
+        post.is_liked = row.get('is_liked', False)
+        post.is_favorite = post.id in favorite_ids
+    return posts
+
+
+# Ветки комментариев в порядке дерева. Корни — по индексу (post, depth, path),
+# ответы — подзапрос на каждый корень: первые N+1 потомков по (post, path) с LIMIT,
+# все подзапросы объединены UNION ALL, как в load_conversation_page. База читает
+# не больше страницы веток по N+2 комментария, сколько бы ответов ни было под корнем
+def load_comment_threads(post, after=None):
+    threads_page = settings.COMMENT_THREADS_PAGE_SIZE
+    replies_per_thread = settings.COMMENT_REPLIES_PER_THREAD
+
+    roots = Comment.objects.filter(post=post, depth=0)
+    if after:
+        roots = roots.filter(path__gt=after)
+    root_paths = list(roots.order_by('path').values_list('path', flat=True)[:threads_page + 1])
+    has_more_threads = len(root_paths) > threads_page
+    root_paths = root_paths[:threads_page]
+    if not root_paths:
+        return [], False
+
+    parts = [
+        # Корень + N ответов, и ещё один — чтобы понять, есть ли продолжение
+        Comment.objects.filter(post=post, path__gte=path, path__lt=path + '0')
+        .order_by('path').values('id')[:replies_per_thread + 2].query.sql_with_params()
+        for path in root_paths
+    ]
+    ids_sql = ' UNION ALL '.join(f'SELECT * FROM ({sql})' for sql, params in parts)
+    ids_params = [param for sql, params in parts for param in params]
+    comments = Comment.objects.filter(id__in=RawSQL(ids_sql, ids_params)).select_related('author__profile').order_by()
+
+    # Плоские списки в порядке дерева, по одному на ветку; глубину даёт comment.depth
+    threads = []
+    for comment in sorted(comments, key=lambda comment: comment.path):
+        if comment.depth == 0:
+            threads.append({'root': comment, 'comments': [], 'more_replies_after': None})
+        thread = threads[-1]
+        if len(thread['comments']) > replies_per_thread:
+            thread['more_replies_after'] = thread['comments'][-1].path
+            continue
+        thread['comments'].append(comment)
+    return threads, has_more_threads
+
+
+@query_budget(6)
 @login_required
 def profile_view(request, username):
     user = get_object_or_404(User, username=username)
@@ -193,6 +368,7 @@ def profile_view(request, username):
     return render(request, 'app/profile_view.html', {'profile_user': user, 'profile': profile})
 
 
+@query_budget(7)
 @login_required
 def profile_edit(request):
     profile, created = UserProfile.objects.get_or_create(user=request.user)
@@ -209,97 +385,147 @@ def profile_edit(request):
     return render(request, 'app/profile_edit.html', {"form": form})
 
 
+@query_budget(7)
 @login_required
 def my_posts(request):
     # Получаем только посты текущего пользователя
-    posts = Post.objects.filter(author=request.user).select_related('author__profile').prefetch_related('likes',
-                                                                                                        'comments')
+    page = paginate_by_cursor(
+        Post.objects.filter(author=request.user).select_related('author__profile').defer('content'),
+        cursor=request.GET.get('cursor'),
+    )
 
     # Передаем список posts в шаблон my_posts.html
     context = {
-        'posts': posts,
+        'posts': attach_viewer_state(page.items, request.user),
+        'page': page,
     }
     return render(request, 'app/my_posts.html', context)
 
 
+@query_budget(7)
 @login_required
 def favorites(request):
-    favorite_entries = Favorite.objects.filter(user=request.user).select_related(
-        'post__author__profile').prefeth_related('post__likes', 'post__comments')
-    posts = [entry.post for entry in favorite_entries]
-    return render(request, 'app/favorites.html', {'posts': posts})
+    # Страница избранного упорядочена по времени добавления в избранное
+    page = paginate_by_cursor(
+        Favorite.objects.filter(user=request.user).select_related('post__author__profile').defer('post__content'),
+        cursor=request.GET.get('cursor'),
+    )
+    posts = attach_viewer_state([entry.post for entry in page], request.user)
+    return render(request, 'app/favorites.html', {'posts': posts, 'page': page})
 
 
+@query_budget(5)
 @login_required
+@require_POST
 def toggle_favorite(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    if post.author == request.user:
-        messages.error(request, "Нельзя добавить в избранное свой пост")
+    post = get_object_or_404(Post.objects.only('id', 'title', 'author_id'), id=post_id)
+    if post.author_id == request.user.id:
+        error = "Нельзя добавить в избранное свой пост"
+        if wants_json(request):
+            return JsonResponse({'error': error}, status=400)
+        messages.error(request, error)
         next_url = request.META.get("HTTP_REFERER", reverse('home'))
         return HttpResponseRedirect(next_url)
-    favorite_obj, created = Favorite.objects.get_or_create(user=request.user, post=post)
+    favorite = toggles.toggle_favorite(request.user.id, post, requested_state(request))
+    if wants_json(request):
+        return JsonResponse({'favorite': favorite})
 
-    action = "добавлен в избранное"
-    if not created:
-        favorite_obj.delete()
-        action = "удален из"
+    action = "добавлен в избранное" if favorite else "удален из"
     messages.info(request, f'Пост"{post.title} {action}"')
     next_url = request.META.get("HTTP_REFERER", reverse('home'))
     return HttpResponseRedirect(next_url)
 
 
+@query_budget(9)
 @login_required
 def messages_list(request, recipient_id=None):
-    # Получаем список всех собеседников (людей, с которыми была переписка)
-    sent_by_me = Message.objects.filter(sender=request.user).values_list('recipient_id', flat=True)
-    sent_to_me = Message.objects.filter(recipient=request.user).values_list('sender_id', flat=True)
-    all_contact_ids = set(list(sent_by_me) + list(sent_to_me))
-    contacts = User.objects.filter(id__in=all_contact_ids).select_related('profile').distinct()
-    # Подсчитываем непрочитанные сообщения *для каждого контакта*
-    contacts_with_unread = []
-    for contact in contacts:
-        unread_count = Message.objects.filter(
-            sender=contact,  # Сообщение отправлено *от* этого контакта
-            recipient=request.user,  # ... и адресовано *текущему пользователю*
-            is_read=False  # ... и *ещё не прочитано*
-        ).count()
-        contacts_with_unread.append({
-            'contact': contact,
-            'unread_count': unread_count
-        })
-
-    # Сортировка контактов по времени последнего сообщения
-    def get_last_message_time(contact):
-        last_msg = Message.objects.filter(
-            (Q(sender=request.user) & Q(recipient=contact)) |
-            (Q(sender=contact) & Q(recipient=request.user))
-        ).order_by('-timestamp').first()
-        return last_msg.timestamp if last_msg else None
+    # Список переписок — один запрос по индексу (user, -last_message_at)
+    conversations = list(Conversation.objects.filter(user=request.user).with_unread_count().select_related(
+        'contact__profile').order_by('-last_message_at'))
+    conversations_by_contact = {conversation.contact_id: conversation for conversation in conversations}
 
-    sorted_contacts_with_unread = sorted(contacts_with_unread, key=lambda x: get_last_message_time(x['contact']),
-                                         reverse=True)
     selected_conversation = None
     selected_recipient = None
+    older_cursor = None
     if recipient_id:
         selected_recipient = get_object_or_404(User, id=recipient_id)
-        if selected_recipient.id in all_contact_ids:
-            # Отмечаем сообщения от selected_recipient как прочитанные
-            Message.objects.filter(recipient=request.user, sender=selected_recipient, is_read=False).update(
-                is_read=True)
-            selected_conversation = Message.objects.filter(
-                (Q(sender=request.user) & Q(recipient=selected_recipient)) |
-                (Q(sender=selected_recipient) & Q(recipient=request.user))
-            ).select_related('sender__profile').order_by('timestamp')
-
-    unread_count_total = Message.objects.filter(recipient=request.user, is_read=False).count()
+        conversation = conversations_by_contact.get(selected_recipient.id)
+        if conversation:
+            # Только последние MESSAGES_PAGE_SIZE сообщений, более ранние — messages_older
+            page = load_conversation_page(request.user, selected_recipient.id)
+            selected_conversation, older_cursor = page.items[::-1], page.next_cursor
+            # Прочитано всё до самого нового показанного сообщения: одна строка Conversation
+            if conversation.has_unread and page.items:
+                mark_conversation_read(request.user.id, selected_recipient.id, page.items[0].pk)
+                conversation.unread_count = 0
+
+    contacts_with_unread = [
+        {'contact': conversation.contact, 'unread_count': conversation.unread_count}
+        for conversation in conversations
+    ]
+    unread_count_total = sum(conversation.unread_count for conversation in conversations)
     return render(request, 'app/messages_list.html', {
-        'contacts_with_unread': sorted_contacts_with_unread,  # Передаём список словарей
+        'contacts_with_unread': contacts_with_unread,  # Передаём список словарей
         'selected_conversation': selected_conversation,
         'selected_recipient': selected_recipient,
+        'older_cursor': older_cursor,
         'unread_count': unread_count_total,
     })
 
 
+def load_conversation_page(user, contact_id, cursor=None):
+    # Переписка от новых к старым по (timestamp, id); next_cursor ведёт к более ранним.
+    # Каждое направление — свой подзапрос по индексу (sender, recipient, timestamp, id)
+    # с LIMIT N+1, оба объединены UNION ALL: база читает не больше 2(N+1) строк,
+    # сколько бы ни было сообщений в переписке. Два списка сливаются здесь
+    page_size = settings.MESSAGES_PAGE_SIZE
+    before = decode_cursor(cursor) if cursor else None
+    if before is not None:
+        direction, value, pk = before
+        try:
+            before = Message._meta.get_field('timestamp').to_python(value), pk
+        except ValidationError:
+            before = None
+        if direction != NEXT:
+            before = None
+
+    parts = []
+    for sender_id, recipient_id in ((user.pk, contact_id), (contact_id, user.pk)):
+        messages_from = Message.objects.filter(sender_id=sender_id, recipient_id=recipient_id)
+        if before is not None:
+            timestamp, pk = before
+            # timestamp <= задаёт диапазон индекса, остальное отсекает равные по времени
+            messages_from = messages_from.filter(Q(timestamp__lt=timestamp) | Q(id__lt=pk), timestamp__lte=timestamp)
+        parts.append(messages_from.order_by('-timestamp', '-id').values('id')[:page_size + 1].query.sql_with_params())
+    ids_sql = ' UNION ALL '.join(f'SELECT * FROM ({sql})' for sql, params in parts)
+    ids_params = [param for sql, params in parts for param in params]
+
+    rows = Message.objects.filter(id__in=RawSQL(ids_sql, ids_params)).select_related('sender__profile').order_by()
+    rows = sorted(rows, key=lambda message: (message.timestamp, message.pk), reverse=True)[:page_size + 1]
+    items = rows[:page_size]
+    next_cursor = encode_cursor(NEXT, items[-1].timestamp, items[-1].pk) if len(rows) > page_size else None
+    return CursorPage(items, next_cursor)
+
+
+@query_budget(3)
+@login_required
+def messages_older(request, recipient_id):
+    # Догрузка более ранних сообщений: HTML-фрагмент или JSON для fetch-клиентов
+    page = load_conversation_page(request.user, recipient_id, request.GET.get('cursor'))
+    selected_conversation = page.items[::-1]
+    if wants_json(request):
+        return JsonResponse({
+            'messages': [message_event(message) for message in selected_conversation],
+            'older_cursor': page.next_cursor,
+        })
+    return render(request, 'app/message_fragment.html', {
+        'selected_conversation': selected_conversation,
+        'older_cursor': page.next_cursor,
+        'contact_id': recipient_id,
+    })
+
+
+@query_budget(6)
 @login_required
 def send_message(request, recipient_id):
     recipient = get_object_or_404(User, id=recipient_id)
@@ -325,28 +551,144 @@ def send_message(request, recipient_id):
     })
 
 
-def shop_home(request):
-    product = Product.objects.select_related("category").all()
-    categories = Category.objects.all()
-    return render(request, 'app/shop/home.html', {
-        "products": product,
-        "categories": categories
+@query_budget(2)
+@login_required
+async def notifications_stream(request):
+    # Server-Sent Events: непрочитанные сообщения, лайки и комментарии к постам пользователя.
+    # Под WSGI бесконечный поток занял бы поток сервера целиком — отвечаем 204,
+    # и EventSource больше не переподключается
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    return StreamingHttpResponse(notification_stream(user.pk), content_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # nginx не должен буферизовать поток
+        'X-Accel-Buffering': 'no',
     })
 
 
+# Условный GET для анонимных посетителей магазина: ETag по версии магазина,
+# Last-Modified по Product.updated_at. Для авторизованных валидаторов нет — у них своя шапка.
+def shop_etag(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return f'shop-{shop_version()}'
+
+
+def shop_modified(request, product_id=None, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return shop_last_modified(product_id)
+
+
+@query_budget(9)
+@condition(etag_func=shop_etag, last_modified_func=shop_modified)
+@cache_anonymous_shop_page
+def shop_home(request):
+    return render_catalog(request)
+
+
+@query_budget(10)
+@condition(etag_func=shop_etag, last_modified_func=shop_modified)
+@cache_anonymous_shop_page
 def shop_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
-    products = Product.objects.filter(category=category).select_related("category")
-    categories = Category.objects.all()
-    return render(request, "app/shop/category.html", {
-        "products": products,
+    return render_catalog(request, category)
+
+
+def render_catalog(request, category=None):
+    form = ProductFilterForm(request.GET)
+    filters = form.filters()
+    if category is not None:
+        filters['category'] = category.id
+    field, descending = CATALOG_SORTS[filters.get('sort', 'new')]
+
+    page = paginate_by_cursor(
+        filter_products(Product.objects.with_primary_image(), filters),
+        cursor=request.GET.get('cursor'),
+        field=field,
+        page_size=settings.SHOP_PAGE_SIZE,
+        descending=descending,
+    )
+    categories, price_buckets = product_facets(filters)
+    return render(request, 'app/shop/category.html' if category else 'app/shop/home.html', {
+        "products": page.items,
+        "page": page,
+        "form": form,
+        "filters": filters,
         "category": category,
         "categories": categories,
+        "price_buckets": price_buckets,
     })
 
 
+# Сортировки каталога: поле keyset-пагинации и направление
+CATALOG_SORTS = {
+    'new': ('created_at', True),
+    'price': ('price', False),
+    '-price': ('price', True),
+}
+
+
+def filter_products(queryset, filters, exclude=()):
+    # exclude — фильтры, которые не применяем (для подсчёта фасета по этому же измерению)
+    if filters.get('q'):
+        queryset = queryset.filter(id__in=RawSQL(*product_ids_sql(filters['q'])))
+    if 'category' in filters and 'category' not in exclude:
+        queryset = queryset.filter(category_id=filters['category'])
+    if 'price' not in exclude:
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lt=filters['max_price'])
+    return queryset
+
+
+def product_facets(filters):
+    return cached_shop_facets(filters, lambda: count_product_facets(filters))
+
+
+def count_product_facets(filters):
+    # Число товаров в каждой категории при остальных фильтрах — один GROUP BY по индексу
+    category_counts = dict(
+        filter_products(Product.objects.all(), filters, exclude=('category',))
+        .order_by().values_list('category_id').annotate(count=Count('id'))
+    )
+    categories = list(Category.objects.order_by('name'))
+    for cat in categories:
+        cat.product_count = category_counts.get(cat.id, 0)
+
+    # Ценовые диапазоны — одним запросом с условными COUNT
+    buckets = settings.SHOP_PRICE_BUCKETS
+    conditions = []
+    for low, high in buckets:
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        conditions.append(condition)
+    counts = filter_products(Product.objects.all(), filters, exclude=('price',)).aggregate(
+        **{f'bucket_{i}': Count('id', filter=condition) for i, condition in enumerate(conditions)}
+    )
+    price_buckets = [
+        {
+            'min_price': low,
+            'max_price': high,
+            'count': counts[f'bucket_{i}'],
+            'active': filters.get('min_price') == low and filters.get('max_price') == high,
+        }
+        for i, (low, high) in enumerate(buckets)
+    ]
+    return categories, price_buckets
+
+
+@query_budget(6)
+@condition(etag_func=shop_etag, last_modified_func=shop_modified)
+@cache_anonymous_shop_page
 def shop_product_detail(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    # Вся галерея одним запросом; главное изображение выбирается из неё же
+    product = get_object_or_404(Product.objects.select_related('category').prefetch_related('images'), id=product_id)
     return render(request, "app/shop/product_detail.html", {
         "product": product
     })
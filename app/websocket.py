@@ -0,0 +1,153 @@
+import asyncio
+import json
+from http.cookies import SimpleCookie
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http.request import validate_host
+from django.utils.module_loading import import_string
+from .realtime import broker, mark_conversation_read
+
+
+# WebSocket личных сообщений на ASGI-приложении (BLOG/asgi.py), без Channels.
+# Клиент подключается к MESSAGES_SOCKET_PATH с cookie сессии и получает JSON-события:
+#   {"type": "message", ...}  — новое сообщение, где он отправитель или получатель
+#   {"type": "read", "reader": id} — собеседник прочитал переписку
+#   {"type": "resync"}  — события потеряны, страницу нужно перечитать
+# Сам клиент может прислать {"type": "read", "contact": id, "message": id}, увидев сообщение
+# (без "message" — прочитано всё полученное от contact).
+MESSAGES_SOCKET_PATH = '/ws/messages/'
+
+# Коды закрытия (4000–4999 — для приложений)
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+CLOSE_UNAUTHORIZED = 4401
+
+
+def header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def allowed_hosts():
+    # Как HttpRequest.get_host: при DEBUG и пустом ALLOWED_HOSTS разрешён localhost
+    if settings.DEBUG and not settings.ALLOWED_HOSTS:
+        return ['.localhost', '127.0.0.1', '[::1]']
+    return settings.ALLOWED_HOSTS
+
+
+def origin_allowed(scope):
+    # Браузер шлёт cookie на WebSocket с любого сайта — чужие страницы не пускаем
+    origin = header(scope, b'origin')
+    if origin is None:
+        return True
+    return validate_host(urlsplit(origin).netloc, allowed_hosts())
+
+
+def load_user(scope):
+    # Та же сессия, что у HTTP-запросов; get_user проверяет хеш пароля в сессии
+    cookie = SimpleCookie(header(scope, b'cookie') or '')
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    store = import_string(settings.SESSION_ENGINE).SessionStore
+    try:
+        return get_user(SimpleNamespace(session=store(morsel.value if morsel else None)))
+    finally:
+        close_old_connections()
+
+
+async def send_json(send, event):
+    await send({'type': 'websocket.send', 'text': json.dumps(event, ensure_ascii=False)})
+
+
+async def messages_socket(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+    if not origin_allowed(scope):
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+    user = await sync_to_async(load_user)(scope)
+    if not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': CLOSE_UNAUTHORIZED})
+        return
+
+    await send({'type': 'websocket.accept'})
+    subscription = broker.subscribe(user.pk)
+    # Отправка событий — отдельной задачей, чтение от клиента — здесь
+    pump = asyncio.ensure_future(forward_events(subscription, send))
+    try:
+        while True:
+            event = await receive()
+            if event['type'] == 'websocket.disconnect':
+                break
+            await handle_client_event(user, event)
+    finally:
+        broker.unsubscribe(subscription)
+        pump.cancel()
+
+
+async def forward_events(subscription, send):
+    while True:
+        await send_json(send, await subscription.get())
+
+
+async def handle_client_event(user, event):
+    try:
+        data = json.loads(event.get('text') or '')
+    except ValueError:
+        return
+    if not isinstance(data, dict):
+        return
+    message_id = data.get('message')
+    if data.get('type') == 'read' and isinstance(data.get('contact'), int):
+        await sync_to_async(read_conversation)(user.pk, data['contact'], message_id if isinstance(message_id, int) else None)
+
+
+def read_conversation(user_id, contact_id, message_id=None):
+    try:
+        mark_conversation_read(user_id, contact_id, message_id)
+    finally:
+        close_old_connections()
+
+
+async def websocket_application(scope, receive, send):
+    if scope['path'] == MESSAGES_SOCKET_PATH:
+        return await messages_socket(scope, receive, send)
+    await receive()
+    await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+
+
+class InProcessClient:
+    # Подключение к websocket_application без сервера — события ASGI через очереди.
+    # Для тестов и manage.py benchmark_websockets
+    def __init__(self, path=MESSAGES_SOCKET_PATH, headers=()):
+        self.scope = {'type': 'websocket', 'path': path,
+                      'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.task = None
+
+    async def connect(self, timeout=1):
+        # Возвращает первое событие сервера: websocket.accept или websocket.close
+        self.task = asyncio.ensure_future(websocket_application(self.scope, self.incoming.get, self.outgoing.put))
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.receive(timeout)
+
+    async def receive(self, timeout=1):
+        return await asyncio.wait_for(self.outgoing.get(), timeout)
+
+    async def receive_json(self, timeout=1):
+        return json.loads((await self.receive(timeout))['text'])
+
+    async def send_json(self, data):
+        await self.incoming.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task